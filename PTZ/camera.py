@@ -1,4 +1,4 @@
-import sys
+import threading
 
 import requests
 from requests.auth import HTTPBasicAuth
@@ -13,13 +13,25 @@ class Camera:
         self.MAXSPEED = 65
 
 
-        # Check if the camera can connect via http
+        # Check if the camera can connect via http, the check doesn't block the startup
+        self.connected = threading.Event()
+        # Set when the first check is done, also if the camera isn't reachable
+        self.checked = threading.Event()
+        self._probe_thread = threading.Thread(target=self.probe, daemon=True)
+        self._probe_thread.start()
+
+    def probe(self):
+        """checks if the camera answers via http, sets connected and returns it"""
         url = 'http://' + self._ip + '/cgi-bin/hi3510/param.cgi?cmd=getnetattr'
         try:
-            requests.get(url, auth=HTTPBasicAuth(self._user, self._password))
+            requests.get(url, auth=HTTPBasicAuth(self._user, self._password), timeout=5)
+            self.connected.set()
         except Exception as ex:
-            print(ex)
-            sys.exit()
+            self.connected.clear()
+            print("Camera not reachable:", ex)
+        finally:
+            self.checked.set()
+        return self.connected.is_set()
 
     def __str__(self):
         return str({'IP': self._ip,
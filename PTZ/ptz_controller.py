@@ -1,31 +1,60 @@
-import multiprocessing
+import threading
+import time
+from collections import deque
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from PTZ.camera import Camera
 
 
 class CameraController:
-    def __init__(self, cam: Camera):
+    def __init__(self, cam: Camera, timeout=2, retry_interval=10):
         self._cam = cam
         self._speed = 65
+        self._timeout = timeout
+        # While the camera isn't reachable its commands are dropped, it's checked again each retry_interval seconds
+        self._retry_interval = retry_interval
+        self._next_probe = time.monotonic() + retry_interval
         self.__url = 'http://' + self._cam._ip + '/cgi-bin/hi3510/ptzctrl.cgi'
 
-        self.jobs = multiprocessing.JoinableQueue()
-        self.createProcesses(self.jobs, 2)
-
-    def createProcesses(self, jobs, concorrenza):
-        """the movements are manages concurrently by requests"""
-        for _ in range(concorrenza):
-            proc = multiprocessing.Process(None, target=self._perform_move, args=(jobs,))
-            proc.daemon = True
-            proc.start()
+        # The connection to the camera is kept alive between the commands
+        self._session = requests.Session()
+        self._session.auth = HTTPBasicAuth(self._cam._user, self._cam._password)
+        self._session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+
+        # The commands are sent in order by a single thread
+        self.jobs = deque()
+        self._condition = threading.Condition()
+        self._last_sent = None
+        self.commands_sent = 0
+        self.commands_coalesced = 0
+        self.commands_dropped = 0
+        self._dispatcher = threading.Thread(target=self._perform_move, daemon=True)
+        self._dispatcher.start()
+
+    def _put(self, params):
+        """queues a movement, if it's the same of the last one queued, or of the continuous
+        movement the camera is doing, it's dropped"""
+        with self._condition:
+            last = self.jobs[-1] if self.jobs else self._last_sent
+            continuous = params.get('-step') == '0'
+            if params == last and (self.jobs or continuous):
+                self.commands_coalesced += 1
+                return
+            self.jobs.append(params)
+            self._condition.notify()
 
     def stop(self):
+        """the stop has the priority, the movements still queued are dropped"""
         params = {
             '-act': 'stop'
         }
-        self.jobs.put(params)
+        with self._condition:
+            self.commands_coalesced += len(self.jobs)
+            self.jobs.clear()
+            self.jobs.append(params)
+            self._condition.notify()
 
     def move_right(self, continuous=True):
         step = 0
@@ -37,7 +66,7 @@ class CameraController:
             '-act': 'right',
             '-speed': str(self._speed)
         }
-        self.jobs.put(params)
+        self._put(params)
 
     def move_left(self, continuous=True):
         step = 0
@@ -49,7 +78,7 @@ class CameraController:
             '-act': 'left',
             '-speed': str(self._speed)
         }
-        self.jobs.put(params)
+        self._put(params)
 
     def move_up(self, continuous=True):
         step = 0
@@ -61,7 +90,7 @@ class CameraController:
             '-act': 'up',
             '-speed': str(self._speed)
         }
-        self.jobs.put(params)
+        self._put(params)
 
     def move_down(self, continuous=True):
         step = 0
@@ -73,7 +102,7 @@ class CameraController:
             '-act': 'down',
             '-speed': str(self._speed)
         }
-        self.jobs.put(params)
+        self._put(params)
 
     def zoom_in(self, continuous=True):
         step = 0
@@ -85,7 +114,7 @@ class CameraController:
             '-act': 'zoomin',
             '-speed': str(self._speed)
         }
-        self.jobs.put(params)
+        self._put(params)
 
     def zoom_out(self, continuous=True):
         step = 0
@@ -96,13 +125,31 @@ class CameraController:
             '-step': str(step),
             '-act': 'zoomout'
         }
-        self.jobs.put(params)
+        self._put(params)
 
-    def _perform_move(self, jobs):
+    def _perform_move(self):
         """perform movement specified by the parameters in the jobs queue"""
         while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self.jobs) > 0)
+                params = self.jobs.popleft()
+                self._last_sent = params
+            # The commands aren't sent to a camera not reachable, each one would wait the whole timeout
+            self._cam.checked.wait()
+            if not self._cam.connected.is_set() and not self._reconnect():
+                self.commands_dropped += 1
+                continue
             try:
-                params = jobs.get()
-                requests.get(self.__url, params, auth=HTTPBasicAuth(self._cam._user, self._cam._password))
+                self._session.get(self.__url, params=params, timeout=self._timeout)
+                self.commands_sent += 1
             except Exception as e:
                 print(e)
+                self._cam.connected.clear()
+                self._next_probe = time.monotonic() + self._retry_interval
+
+    def _reconnect(self):
+        """checks the camera again if the retry interval passed since the last check, returns if it's reachable"""
+        if time.monotonic() < self._next_probe:
+            return False
+        self._next_probe = time.monotonic() + self._retry_interval
+        return self._cam.probe()
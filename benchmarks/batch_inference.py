@@ -0,0 +1,102 @@
+"""Measures throughput and latency of the VideoTracker workers for each batching setting.
+
+Run from the repository root:
+    python -m benchmarks.batch_inference --source video.mp4 --batch-sizes 1 2 4 --max-waits 0.01 0.05 --workers 1 2 5
+
+Each setting runs in its own process because VideoTracker is a Singleton, one JSON line is printed for each one.
+"""
+import argparse
+import itertools
+import json
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+
+def load_frames(source, count, width, height):
+    """reads count frames from the video source, if there isn't a source creates random frames"""
+    if source is None:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 255, (height, width, 3), dtype=np.uint8) for _ in range(count)]
+
+    cap = cv2.VideoCapture(source)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            # Starts again if the video is shorter than the frames requested
+            if not frames:
+                raise ValueError(f"Can't read frames from {source}")
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            continue
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def run_setting(args):
+    """sends the frames to the tracker as fast as the slots allow and measures the results"""
+    from video_tracker import VideoTracker
+
+    frames = load_frames(args.source, args.frames, args.width, args.height)
+    tracker = VideoTracker(concurrency=args.workers[0], batch_size=args.batch_sizes[0], max_wait=args.max_waits[0])
+    stream = tracker.camera(tracker.add_camera(frames[0].shape))
+
+    # Warm up, the first predictions of each worker are slower
+    for frame in frames[:args.workers[0]]:
+        tracker.submit_frame(frame)
+    while stream.frames_completed < args.workers[0]:
+        tracker.get_results()
+        time.sleep(0.001)
+
+    tracker.reset_stats()
+    started = time.perf_counter()
+    submitted = 0
+    while stream.frames_completed < len(frames):
+        if submitted < len(frames) and tracker.submit_frame(frames[submitted]):
+            submitted += 1
+        elif tracker.get_results() is None:
+            time.sleep(0.0005)
+    elapsed = time.perf_counter() - started
+
+    stats = tracker.inference_stats()
+    print(json.dumps({'workers': args.workers[0],
+                      'batch_size': args.batch_sizes[0],
+                      'max_wait': args.max_waits[0],
+                      'frames': len(frames),
+                      'fps': len(frames) / elapsed,
+                      'latency_ms_mean': stats.get('latency_ms_mean'),
+                      'latency_ms_p50': stats.get('latency_ms_p50'),
+                      'latency_ms_p95': stats.get('latency_ms_p95')}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=None, help="video file or stream, random frames if missing")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--workers", type=int, nargs="+", default=[5])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--max-waits", type=float, nargs="+", default=[0.02])
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        run_setting(args)
+        return
+
+    for workers, batch_size, max_wait in itertools.product(args.workers, args.batch_sizes, args.max_waits):
+        command = [sys.executable, "-m", "benchmarks.batch_inference", "--single",
+                   "--frames", str(args.frames), "--width", str(args.width), "--height", str(args.height),
+                   "--workers", str(workers), "--batch-sizes", str(batch_size), "--max-waits", str(max_wait)]
+        if args.source is not None:
+            command += ["--source", args.source]
+        subprocess.run(command, check=True)
+
+
+if __name__ == '__main__':
+    main()
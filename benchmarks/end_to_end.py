@@ -0,0 +1,168 @@
+"""Runs frames, detection, zones and lights end to end against a local KNX/IP stand-in.
+
+Run from the repository root:
+    python -m benchmarks.end_to_end --zones 4 --bus-delay 0.02
+    python -m benchmarks.end_to_end --source video.mp4 --detector tracker
+
+With the synthetic video the true positions of the people are known: the ground-truth detector
+measures zones and lights without the model, and the person to telegram latency is the time from
+the capture of the frame where a person enters a zone with the light off to the telegram switching it on.
+One JSON line is printed with fps, per-stage latency and person to telegram latency,
+the capture stage includes the wait for the next frame at the fps of the video.
+"""
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+from benchmarks.mock_knx import MockKNXGateway
+from benchmarks.video_source import VideoSource
+from lights_control import LightGateway
+from metrics import Metrics
+from occupancy import OccupancyEngine
+from zone import Zone
+
+
+def percentiles(values):
+    """mean, p50, p95 and p99 of the seconds in values, in milliseconds"""
+    if not values:
+        return None
+    values = np.array(values) * 1000
+    return {'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)),
+            'p99': float(np.percentile(values, 99))}
+
+
+def grid_zones(count, width, height, margin=20):
+    """count rectangular zones that cover the frame in a grid"""
+    columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    cell_width, cell_height = width / columns, height / rows
+    zones = []
+    for index in range(count):
+        x, y = (index % columns) * cell_width, (index // columns) * cell_height
+        zones.append([(x + margin, y + margin), (x + cell_width - margin, y + margin),
+                      (x + cell_width - margin, y + cell_height - margin), (x + margin, y + cell_height - margin)])
+    return zones
+
+
+def telegram_latencies(entries, telegrams, timeout=5.0):
+    """for each (address, time) a person entered a zone with the light off, seconds until the light was
+    switched on. Returns the latencies and how many entries didn't get a telegram within timeout"""
+    latencies, missed = [], 0
+    for address, entered in entries:
+        history = [(t, value) for t, group_address, value in telegrams if group_address == address]
+        before = [value for t, value in history if t < entered]
+        if before and before[-1] == 1:
+            # The light was still on, there isn't a telegram to wait for
+            continue
+        after = [t for t, value in history if t >= entered and value == 1]
+        if after and after[0] - entered <= timeout:
+            latencies.append(after[0] - entered)
+        else:
+            missed += 1
+    return latencies, missed
+
+
+def run(video, detector="ground-truth", zones=4, hold_time=1.0, bus_delay=0.02, workers=2, imgsz=640):
+    knx = MockKNXGateway(bus_delay=bus_delay)
+    knx.start()
+    LightGateway(knx.connection_config())
+
+    tracker = camera = None
+    if detector == "tracker":
+        from video_tracker import VideoTracker
+        tracker = VideoTracker(concurrency=workers, imgsz=imgsz)
+        camera = tracker.add_camera((video.height, video.width, 3))
+        Zone.listeners.append(tracker.set_zones)
+        tracker.start()
+
+    created = [Zone.create_zone(points, hold_time=hold_time) for points in grid_zones(zones, video.width, video.height)]
+    knx.status_addresses.update({zone.light.status_address: zone.light.address for zone in created})
+    # The states are read and the lights still on are switched off, the run starts when the bus is idle
+    deadline = time.monotonic() + 10
+    while any(zone.light.pending for zone in created) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    startup_telegrams = len(knx.telegrams)
+    truth = OccupancyEngine(zone.zone_polygon for zone in created)
+    truth_counts = np.zeros(zones, dtype=np.int64)
+    entries = []
+
+    stages = {'capture': [], 'detection': [], 'zones': []}
+    started = time.perf_counter()
+    frames = 0
+    while True:
+        t0 = time.perf_counter()
+        ret, frame = video.read()
+        if not ret:
+            break
+        t1 = time.perf_counter()
+        people = video.people(video.last_frame_index)
+        if tracker is not None:
+            centers = tracker.object_detection(frame, video.last_frame_time, camera)
+        else:
+            centers = people
+        t2 = time.perf_counter()
+        Zone.update_zone(centers)
+        t3 = time.perf_counter()
+        stages['capture'].append(t1 - t0)
+        stages['detection'].append(t2 - t1)
+        stages['zones'].append(t3 - t2)
+        frames += 1
+
+        if people is not None:
+            counts = truth.count(people, Zone.collider_borders)
+            for index in np.flatnonzero((truth_counts == 0) & (counts > 0)):
+                entries.append((created[index].light.address, video.last_frame_time))
+            truth_counts = counts
+    elapsed = time.perf_counter() - started
+
+    # The telegrams still queued are sent in the next seconds
+    time.sleep(bus_delay * zones + 0.5)
+    latencies, missed = telegram_latencies(entries, knx.telegrams)
+    knx.stop()
+    return {'benchmark': 'end_to_end',
+            'detector': detector,
+            'frames': frames,
+            'zones': zones,
+            'bus_delay': bus_delay,
+            'fps': frames / elapsed,
+            'stage_latency_ms': {stage: percentiles(values) for stage, values in stages.items()},
+            'person_to_telegram_ms': percentiles(latencies),
+            'zone_entries': len(entries),
+            'telegrams_missed': missed,
+            'telegrams': len(knx.telegrams) - startup_telegrams,
+            'metrics': Metrics().snapshot()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=None, help="video file, synthetic frames if missing")
+    parser.add_argument("--detector", choices=["ground-truth", "tracker"], default="ground-truth")
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=float, default=25, help="frames per second of the video, 0 is as fast as possible")
+    parser.add_argument("--people", type=int, default=3, help="people walking in the synthetic video")
+    parser.add_argument("--zones", type=int, default=4)
+    parser.add_argument("--hold-time", type=float, default=1.0)
+    parser.add_argument("--bus-delay", type=float, default=0.02, help="seconds each telegram takes on the bus")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--imgsz", type=int, default=640)
+    args = parser.parse_args()
+
+    fps = args.fps or None
+    if args.source is None:
+        video = VideoSource.synthetic(args.width, args.height, args.frames, args.people, fps)
+    else:
+        video = VideoSource.recorded(args.source, args.frames, args.width, args.height, fps)
+    if args.detector == "ground-truth" and video.people(0) is None:
+        parser.error("the ground-truth detector needs the synthetic video")
+    print(json.dumps(run(video, args.detector, args.zones, args.hold_time, args.bus_delay, args.workers, args.imgsz)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Compares accuracy and frames per second of the person detection at each inference size.
+
+Run from the repository root:
+    python -m benchmarks.inference_resolution --source video.mp4 --sizes 320 416 640 --reference-size 1280
+
+The detections at the reference size are used as ground truth, for each size the frames are letterboxed
+like in VideoTracker and one JSON line with precision, recall and fps is printed.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from ultralytics import YOLO
+
+from benchmarks.batch_inference import load_frames
+from letterbox import Letterbox
+from object_tracker import ObjectTracker
+
+
+def detect_people(model, frames, size):
+    """returns the person boxes of each frame in frame coordinates and the seconds spent"""
+    letterbox = Letterbox(size)
+    square = np.empty((size, size, 3), dtype=np.uint8)
+    detections = []
+    started = time.perf_counter()
+    for frame in frames:
+        transform = letterbox.apply(frame, square)
+        data = model.predict(square, imgsz=size, verbose=False)[0].boxes.data.cpu().numpy()
+        people = data[(data[:, 5] == 0) & (data[:, 4] >= 0.5), :4]
+        detections.append(Letterbox.unmap(people, transform))
+    return detections, time.perf_counter() - started
+
+
+def match(detected, reference, iou_threshold=0.5):
+    """number of detected boxes that overlap a different reference box"""
+    if len(detected) == 0 or len(reference) == 0:
+        return 0
+    iou = ObjectTracker.iou(detected[:, :4].astype(np.float64), reference[:, :4].astype(np.float64))
+    matched_detected, matched_reference = set(), set()
+    for i, j in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+        if iou[i, j] < iou_threshold:
+            break
+        if i not in matched_detected and j not in matched_reference:
+            matched_detected.add(i)
+            matched_reference.add(j)
+    return len(matched_detected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=None, help="video file, random frames if missing")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[320, 416, 640])
+    parser.add_argument("--reference-size", type=int, default=1280)
+    parser.add_argument("--model", default="yolov8n.pt")
+    args = parser.parse_args()
+
+    model = YOLO(args.model)
+    frames = load_frames(args.source, args.frames, args.width, args.height)
+    # The first prediction loads the model, it's not measured
+    model.predict(frames[0], verbose=False)
+
+    reference, _ = detect_people(model, frames, args.reference_size)
+    reference_count = sum(len(boxes) for boxes in reference)
+    for size in args.sizes:
+        detections, elapsed = detect_people(model, frames, size)
+        detected_count = sum(len(boxes) for boxes in detections)
+        matched = sum(match(d, r) for d, r in zip(detections, reference))
+        print(json.dumps({'size': size,
+                          'frames': len(frames),
+                          'fps': len(frames) / elapsed,
+                          'precision': matched / detected_count if detected_count else None,
+                          'recall': matched / reference_count if reference_count else None}))
+
+
+if __name__ == '__main__':
+    main()
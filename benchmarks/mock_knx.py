@@ -0,0 +1,148 @@
+"""A local KNX/IP tunnelling server that records the telegrams instead of sending them to a bus.
+
+It answers the connection, heartbeat and tunnelling requests of xknx like a real interface and the
+group reads like the actuators, so LightGateway can be measured without a KNX installation:
+    knx = MockKNXGateway(bus_delay=0.02)
+    knx.start()
+    LightGateway(knx.connection_config())
+"""
+import socket
+import threading
+import time
+
+from xknx.cemi import CEMIFrame, CEMILData, CEMIMessageCode
+from xknx.dpt import DPTBinary
+from xknx.io import ConnectionConfig, ConnectionType
+from xknx.knxip import (HPAI, ConnectionStateRequest, ConnectionStateResponse, ConnectRequest, ConnectResponse,
+                        ConnectResponseData, DisconnectRequest, DisconnectResponse, KNXIPFrame, TunnellingAck,
+                        TunnellingRequest)
+from xknx.telegram import GroupAddress, IndividualAddress, Telegram
+from xknx.telegram.apci import GroupValueRead, GroupValueResponse, GroupValueWrite
+
+
+class MockKNXGateway:
+    CHANNEL = 1
+
+    def __init__(self, host="127.0.0.1", port=0, bus_delay=0.0, status_addresses=None):
+        """bus_delay is the seconds each telegram takes on the bus before it's confirmed,
+        a KNX TP telegram takes about 20 ms.
+        status_addresses maps each status address to the address of its switch, the reads of a status
+        address are answered with the last value written to the switch, 0 if it was never written"""
+        self.host = host
+        self.bus_delay = bus_delay
+        self.status_addresses = status_addresses if status_addresses is not None else {}
+        # Last value written to each group address
+        self.states = {}
+        # (time.time() of the confirmation, group address, value) of each group write received
+        self.telegrams = []
+        self._telegram_received = threading.Condition()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind((host, port))
+        self.port = self._socket.getsockname()[1]
+        self._data_endpoint = None
+        self._control_endpoint = None
+        self._sequence = 0
+        self._send_lock = threading.Lock()
+        # While offline the requests of xknx are not answered, like an interface that was unplugged
+        self.offline = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def connection_config(self):
+        """the ConnectionConfig that connects xknx to this gateway"""
+        return ConnectionConfig(connection_type=ConnectionType.TUNNELING, gateway_ip=self.host,
+                                gateway_port=self.port, local_ip=self.host, auto_reconnect=True,
+                                auto_reconnect_wait=1)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._socket.close()
+
+    def wait_for(self, count, timeout=5.0):
+        """waits until count telegrams are received, returns False after timeout seconds"""
+        with self._telegram_received:
+            return self._telegram_received.wait_for(lambda: len(self.telegrams) >= count, timeout)
+
+    def bus_write(self, address, value):
+        """another device, e.g. a wall switch, writes the value to the group address,
+        the actuator sends the new state on the status addresses of the switch"""
+        self.states[address] = value
+        statuses = [status for status, switch in self.status_addresses.items() if switch == address]
+        for destination in [address] + statuses:
+            telegram = Telegram(destination_address=GroupAddress(destination),
+                                payload=GroupValueWrite(DPTBinary(value)))
+            self._send_cemi(CEMIFrame(code=CEMIMessageCode.L_DATA_IND,
+                                      data=CEMILData.init_from_telegram(telegram, IndividualAddress("1.1.1"))))
+
+    def drop_connection(self):
+        """closes the tunnel from the interface side, xknx opens it again by itself"""
+        self._send(DisconnectRequest(communication_channel_id=self.CHANNEL,
+                                     control_endpoint=HPAI(self.host, self.port)), self._control_endpoint)
+
+    def _send(self, body, address):
+        self._socket.sendto(KNXIPFrame.init_from_body(body).to_knx(), address)
+
+    def _serve(self):
+        while True:
+            try:
+                data, source = self._socket.recvfrom(1024)
+            except OSError:
+                # The socket was closed by stop
+                return
+            if self.offline:
+                continue
+            frame, _ = KNXIPFrame.from_knx(data)
+            body = frame.body
+            if isinstance(body, ConnectRequest):
+                endpoint = body.data_endpoint
+                self._data_endpoint = source if endpoint.route_back else endpoint.addr_tuple
+                self._sequence = 0
+                control = source if body.control_endpoint.route_back else body.control_endpoint.addr_tuple
+                self._control_endpoint = control
+                self._send(ConnectResponse(communication_channel=self.CHANNEL,
+                                           data_endpoint=HPAI(self.host, self.port),
+                                           crd=ConnectResponseData(individual_address=IndividualAddress("1.1.255"))),
+                           control)
+            elif isinstance(body, ConnectionStateRequest):
+                self._send(ConnectionStateResponse(communication_channel_id=self.CHANNEL), source)
+            elif isinstance(body, DisconnectRequest):
+                self._send(DisconnectResponse(communication_channel_id=self.CHANNEL), source)
+            elif isinstance(body, TunnellingRequest):
+                self._send(TunnellingAck(communication_channel_id=self.CHANNEL,
+                                         sequence_counter=body.sequence_counter), source)
+                self._tunnelling_request(body)
+
+    def _tunnelling_request(self, request):
+        """records the group write and confirms it after bus_delay, like the interface does
+        when the telegram was sent on the bus"""
+        cemi = CEMIFrame.from_knx(request.raw_cemi)
+        if cemi.code != CEMIMessageCode.L_DATA_REQ:
+            return
+        if self.bus_delay:
+            time.sleep(self.bus_delay)
+        address = str(cemi.data.dst_addr)
+        payload = cemi.data.payload
+        value = getattr(payload, "value", None)
+        if isinstance(value, DPTBinary):
+            with self._telegram_received:
+                self.states[address] = value.value
+                self.telegrams.append((time.time(), address, value.value))
+                self._telegram_received.notify_all()
+
+        cemi.code = CEMIMessageCode.L_DATA_CON
+        self._send_cemi(cemi)
+        if isinstance(payload, GroupValueRead):
+            # The actuator answers with the state of its switch
+            state = self.states.get(self.status_addresses.get(address, address), 0)
+            response = Telegram(destination_address=GroupAddress(address),
+                                payload=GroupValueResponse(DPTBinary(state)))
+            self._send_cemi(CEMIFrame(code=CEMIMessageCode.L_DATA_IND,
+                                      data=CEMILData.init_from_telegram(response, IndividualAddress("1.1.1"))))
+
+    def _send_cemi(self, cemi):
+        """sends the frame to xknx on the tunnel, each one with the next sequence number"""
+        with self._send_lock:
+            self._send(TunnellingRequest(communication_channel_id=self.CHANNEL, sequence_counter=self._sequence,
+                                         raw_cemi=cemi.to_knx()), self._data_endpoint)
+            self._sequence = (self._sequence + 1) & 0xFF
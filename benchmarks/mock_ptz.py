@@ -0,0 +1,70 @@
+"""A local HTTP server that answers like the cgi of the PTZ camera and records the commands received.
+
+    ptz = MockPTZServer(response_delay=0.01)
+    ptz.start()
+    controller = CameraController(Camera(ptz.address, "admin", "admin"))
+"""
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class MockPTZServer:
+    def __init__(self, host="127.0.0.1", port=0, response_delay=0.0):
+        """response_delay is the seconds the camera takes to answer each request"""
+        self.response_delay = response_delay
+        # (time.time() of the request, params) of each ptzctrl.cgi request
+        self.commands = []
+        # Client ports that opened a connection, one if the session is kept alive
+        self.connections = set()
+        self._command_received = threading.Condition()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self.address = f"{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for(self, count, timeout=5.0):
+        """waits until count commands are received, returns False after timeout seconds"""
+        with self._command_received:
+            return self._command_received.wait_for(lambda: len(self.commands) >= count, timeout)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.1 keeps the connection open between the requests like the camera does
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Headers and body are written separately, without this the answer waits for the delayed ack
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path.endswith("ptzctrl.cgi"):
+                    server.connections.add(self.client_address[1])
+                    with server._command_received:
+                        server.commands.append((time.time(), dict(parse_qsl(url.query))))
+                        server._command_received.notify_all()
+                if server.response_delay:
+                    time.sleep(server.response_delay)
+                body = b'[Succeed]\r\n'
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
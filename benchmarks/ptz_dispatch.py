@@ -0,0 +1,76 @@
+"""Measures the latency and the coalescing of the PTZ commands against a local stand-in of the camera cgi.
+
+Run from the repository root:
+    python -m benchmarks.ptz_dispatch --commands 100 --response-delay 0.01
+
+One JSON line is printed with the latency of single commands, and for a burst of key repeats
+ended by a stop how many requests reached the camera and how long the stop took.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from benchmarks.mock_ptz import MockPTZServer
+from PTZ.camera import Camera
+from PTZ.ptz_controller import CameraController
+
+
+def run(commands=100, repeats=50, repeat_interval=0.005, response_delay=0.0):
+    ptz = MockPTZServer(response_delay=response_delay)
+    ptz.start()
+    controller = CameraController(Camera(ptz.address, "admin", "admin"))
+
+    # Single steps, each one is waited before sending the next
+    latencies = []
+    for i in range(commands):
+        sent = time.time()
+        if i % 2:
+            controller.move_left(continuous=False)
+        else:
+            controller.move_right(continuous=False)
+        ptz.wait_for(i + 1)
+        latencies.append(ptz.commands[-1][0] - sent)
+
+    # A key held down repeats the same continuous movement until it's released
+    received = len(ptz.commands)
+    for _ in range(repeats):
+        controller.move_up()
+        time.sleep(repeat_interval)
+    stop_sent = time.time()
+    controller.stop()
+    ptz.wait_for(received + 1)
+    deadline = time.time() + 5
+    while ptz.commands[-1][1].get('-act') != 'stop' and time.time() < deadline:
+        time.sleep(0.001)
+    stop_latency = ptz.commands[-1][0] - stop_sent
+    burst_requests = len(ptz.commands) - received
+
+    ptz.stop()
+    latencies = np.array(latencies) * 1000
+    return {'benchmark': 'ptz_dispatch',
+            'commands': commands,
+            'response_delay': response_delay,
+            'latency_ms_mean': float(latencies.mean()),
+            'latency_ms_p50': float(np.percentile(latencies, 50)),
+            'latency_ms_p95': float(np.percentile(latencies, 95)),
+            'burst_repeats': repeats,
+            'burst_requests': burst_requests,
+            'stop_latency_ms': stop_latency * 1000,
+            'connections': len(ptz.connections),
+            'commands_coalesced': controller.commands_coalesced}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=50, help="key repeats of the burst")
+    parser.add_argument("--repeat-interval", type=float, default=0.005)
+    parser.add_argument("--response-delay", type=float, default=0.0, help="seconds the camera takes to answer")
+    args = parser.parse_args()
+    print(json.dumps(run(args.commands, args.repeats, args.repeat_interval, args.response_delay)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Replays synthetic recordings of crowds on the simulated clock, to measure the replay and check its telegrams.
+
+Run from the repository root:
+    python -m benchmarks.replay_crowd --zones 100 --seconds 600
+
+The crowd recording has people walking through a grid of zones. The recording of two zones checks that a
+switch off queued behind the rate limit is replaced by the switch on of a person entering again: both zones
+are emptied on the same frame and one is entered again while its switch off is still waiting.
+One JSON line is printed for each recording, with the telegrams sent and how much faster than real time
+the replay ran. A replay stuck for more than --timeout seconds stops the benchmark with its traceback.
+"""
+import argparse
+import faulthandler
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.end_to_end import grid_zones
+from replay import DetectionRecorder, replay
+from zone import Zone
+
+
+def write_zones(path, zones, hold_time):
+    with open(path, "w") as file:
+        json.dump({'version': 1, 'zones': [{'points': points, 'hold_time': hold_time} for points in zones]}, file)
+
+
+def center(points):
+    return np.mean(points, axis=0)
+
+
+def crowd_recording(path, zones, seconds, fps=25, people=20, seed=0):
+    """people walking at random through the zones, each one to a random point and then to another one"""
+    rng = np.random.default_rng(seed)
+    corners = np.array([point for points in zones for point in points])
+    low, high = corners.min(axis=0), corners.max(axis=0)
+    positions = rng.uniform(low, high, (people, 2))
+    targets = rng.uniform(low, high, (people, 2))
+    recorder = DetectionRecorder(path)
+    for frame in range(int(seconds * fps)):
+        steps = targets - positions
+        distances = np.linalg.norm(steps, axis=1, keepdims=True)
+        arrived = distances[:, 0] < 5
+        targets[arrived] = rng.uniform(low, high, (int(arrived.sum()), 2))
+        positions += steps / np.maximum(distances, 1e-9) * np.minimum(distances, 4)
+        recorder.record(0, frame / fps, positions.tolist())
+    recorder.close()
+
+
+def two_zones_recording(path, zones, fps=25):
+    """both zones occupied, emptied on the same frame, and the second one entered again 40 ms after the hold
+    time expired, while its switch off waits behind the one of the first zone"""
+    first, second = (center(points).tolist() for points in zones)
+    recorder = DetectionRecorder(path)
+    for frame in range(3 * fps):
+        frame_time = frame / fps
+        if frame_time < 0.5:
+            centers = [first, second]
+        elif 1.54 <= frame_time < 2.0:
+            centers = [second]
+        else:
+            centers = []
+        recorder.record(0, frame_time, centers)
+    recorder.close()
+
+
+def run(recording, zones_path, hold_time, rate_limit):
+    # The zones of the recording replayed before are removed, with their lights
+    Zone.delete_zones()
+    started = time.perf_counter()
+    gateway, frames, duration = replay(recording, zones_path, hold_time=hold_time, rate_limit=rate_limit)
+    elapsed = time.perf_counter() - started
+    on = sum(value for _, _, value in gateway.telegrams)
+    return gateway, {'frames': frames, 'duration': round(duration, 3), 'elapsed': round(elapsed, 3),
+                     'speed': round(duration / elapsed, 1) if elapsed else None,
+                     'telegrams': len(gateway.telegrams), 'on': on, 'off': len(gateway.telegrams) - on,
+                     'suppressed': gateway.suppressed, 'coalesced': gateway.coalesced}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--zones", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=600, help="seconds of the crowd recording")
+    parser.add_argument("--hold-time", type=float, default=1.0)
+    parser.add_argument("--rate-limit", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    faulthandler.dump_traceback_later(args.timeout, exit=True)
+    with tempfile.TemporaryDirectory() as directory:
+        recording, zones_path = os.path.join(directory, "detections.rec"), os.path.join(directory, "zones.json")
+
+        zones = grid_zones(2, 640, 480)
+        write_zones(zones_path, zones, 1.0)
+        two_zones_recording(recording, zones)
+        gateway, result = run(recording, zones_path, 1.0, 20)
+        # Both lights on, the first one off after the hold time, the switch off of the second one replaced
+        # and the second one off after it's emptied again
+        expected = [1, 1, 0, 0]
+        values = [value for _, _, value in gateway.telegrams]
+        if values != expected or not gateway.coalesced:
+            raise AssertionError(f"two zones: telegrams {gateway.telegrams}, {gateway.coalesced} coalesced")
+        print(json.dumps({'recording': "two_zones", **result}))
+
+        zones = grid_zones(args.zones, 1920, 1080)
+        write_zones(zones_path, zones, args.hold_time)
+        crowd_recording(recording, zones, args.seconds)
+        _, result = run(recording, zones_path, args.hold_time, args.rate_limit)
+        print(json.dumps({'recording': "crowd", 'zones': args.zones, **result}))
+    faulthandler.cancel_dump_traceback_later()
+
+
+if __name__ == '__main__':
+    main()
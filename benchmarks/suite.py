@@ -0,0 +1,58 @@
+"""Runs all the offline benchmarks and writes their results in one JSON file, to compare them over time.
+
+Run from the repository root:
+    python -m benchmarks.suite --output benchmark_results.json
+    python -m benchmarks.suite --output benchmark_results.json --source video.mp4 --detector tracker
+
+No camera, KNX interface or PTZ head is needed: the video is synthetic or recorded, the telegrams go to
+a local KNX/IP stand-in and the PTZ commands to a local HTTP stand-in. Each benchmark runs in its own
+process because the gateway, the tracker and the zones are shared by the whole process.
+"""
+import argparse
+import datetime
+import json
+import subprocess
+import sys
+
+
+def run_benchmark(module, *arguments):
+    """runs the benchmark module and returns the JSON lines it printed"""
+    command = [sys.executable, "-m", f"benchmarks.{module}", *map(str, arguments)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    # The lights and the zones print their changes too, only the results are kept
+    return [json.loads(line) for line in output.splitlines() if line.startswith("{")]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--source", default=None, help="video file, synthetic frames if missing")
+    parser.add_argument("--detector", choices=["ground-truth", "tracker"], default="ground-truth")
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--bus-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    end_to_end = ["--frames", args.frames, "--bus-delay", args.bus_delay, "--detector", args.detector]
+    if args.source is not None:
+        end_to_end += ["--source", args.source]
+
+    results = {'zone_lookup': run_benchmark("zone_lookup", "--zones", 10, 100, 1000, 5000, "--points", 10, 100, 1000),
+               'ptz_dispatch': run_benchmark("ptz_dispatch", "--response-delay", 0.01),
+               'end_to_end': run_benchmark("end_to_end", *end_to_end),
+               'replay_crowd': run_benchmark("replay_crowd", "--zones", 100, "--seconds", 600)}
+    with open(args.output, "w") as file:
+        json.dump({'date': datetime.datetime.now().isoformat(timespec="seconds"),
+                   'commit': git_commit(),
+                   'results': results}, file, indent=2)
+    print(f"Results written in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""VideoSource plays synthetic or recorded frames with the same read interface of FrameCapture,
+so it can replace the camera in the benchmarks. The synthetic frames also know where the people are"""
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.batch_inference import load_frames
+
+
+class VideoSource:
+    def __init__(self, frames, fps=25, people=None):
+        """frames are played at fps frames per second, as fast as possible if fps is None.
+        people has the true centers of the people of each frame, if they are known"""
+        self._frames = frames
+        self._people = people
+        self.fps = fps
+        self.height, self.width = frames[0].shape[:2]
+        self.last_frame_index = -1
+        self.last_frame_time = None
+        self.frames_captured = 0
+        self._started = None
+
+    @classmethod
+    def synthetic(cls, width=1280, height=720, count=500, people=3, fps=25, seed=0):
+        """people walking on straight lines across a static scene, they bounce on the borders"""
+        rng = np.random.default_rng(seed)
+        background = rng.integers(60, 90, (height, width, 3), dtype=np.uint8)
+        size = np.array([height // 10, height // 4])
+        position = rng.uniform((0, 0), (width - size[0], height - size[1]), (people, 2))
+        # Pixels per frame, about one frame width in ten seconds
+        velocity = rng.uniform(-1, 1, (people, 2)) * width / (10 * (fps or 25))
+        colors = rng.integers(150, 255, (people, 3))
+
+        frames, centers = [], []
+        for _ in range(count):
+            frame = background.copy()
+            for (x, y), color in zip(position.astype(int), colors):
+                cv2.rectangle(frame, (x, y), (x + size[0], y + size[1]), color.tolist(), -1)
+            frames.append(frame)
+            centers.append([tuple(point) for point in (position + size / 2).tolist()])
+
+            position += velocity
+            bounce = (position < 0) | (position > (width - size[0], height - size[1]))
+            velocity[bounce] *= -1
+            position = np.clip(position, 0, (width - size[0], height - size[1]))
+        return cls(frames, fps, centers)
+
+    @classmethod
+    def recorded(cls, source, count=500, width=1280, height=720, fps=25):
+        """frames of a video file, the people positions are unknown"""
+        return cls(load_frames(source, count, width, height), fps)
+
+    def __len__(self):
+        return len(self._frames)
+
+    def people(self, index):
+        """true centers of the people in the frame, None if they are unknown"""
+        return None if self._people is None else self._people[index]
+
+    def read(self, timeout=1.0):
+        """returns the next frame when it's due, (False, None) after the last frame"""
+        if self._started is None:
+            self._started = time.perf_counter()
+        index = self.last_frame_index + 1
+        if index >= len(self._frames):
+            return False, None
+        if self.fps is not None:
+            delay = self._started + index / self.fps - time.perf_counter()
+            if delay > timeout:
+                return False, None
+            if delay > 0:
+                time.sleep(delay)
+        self.last_frame_index = index
+        self.last_frame_time = time.time()
+        self.frames_captured += 1
+        return True, self._frames[index]
+
+    def stats(self):
+        return {'captured': self.frames_captured,
+                'dropped': 0,
+                'read_errors': 0,
+                'reconnections': 0}
+
+    def release(self):
+        pass
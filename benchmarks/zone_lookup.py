@@ -0,0 +1,77 @@
+"""Measures how long counting the people in the zones takes with many zones and many people.
+
+Run from the repository root:
+    python -m benchmarks.zone_lookup --zones 10 100 1000 5000 --points 10 100 1000
+
+For each pair one JSON line is printed with the time to build the index and to count the points,
+and with --brute-force also the time of testing each point against each zone one polygon at a time,
+only up to 100000 pairs because it takes minutes.
+"""
+import argparse
+import itertools
+import json
+import time
+
+import numpy as np
+from shapely import Polygon
+
+from occupancy import OccupancyEngine
+
+
+def random_zones(count, width, height, rng):
+    """quadrilaterals of random size scattered on the frame"""
+    zones = []
+    for x, y in rng.uniform((0, 0), (width, height), (count, 2)):
+        w, h = rng.uniform(20, 200, 2)
+        skew = rng.uniform(-10, 10)
+        zones.append(Polygon([(x, y), (x + w, y + skew), (x + w, y + h), (x + skew, y + h)]))
+    return zones
+
+
+def measure(function, repeats):
+    """median seconds of the calls of function"""
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+    return float(np.median(times))
+
+
+def run(zones, points, borders=50, width=1920, height=1080, repeats=20, brute_force=False, seed=0):
+    rng = np.random.default_rng(seed)
+    polygons = random_zones(zones, width, height, rng)
+    centers = [tuple(point) for point in rng.uniform((0, 0), (width, height), (points, 2)).tolist()]
+
+    engine = OccupancyEngine()
+    result = {'benchmark': 'zone_lookup',
+              'zones': zones,
+              'points': points,
+              'index_ms': measure(lambda: engine.set_polygons(polygons), repeats) * 1000,
+              'count_ms': measure(lambda: engine.count(centers, borders), repeats) * 1000}
+
+    if brute_force and zones * points <= 100000:
+        # The zones are tested one by one, each point as a square intersected with the zone polygon
+        def count_each():
+            for polygon in polygons:
+                sum(polygon.intersects(Polygon([(x - borders, y - borders), (x - borders, y + borders),
+                                                (x + borders, y + borders), (x + borders, y - borders)]))
+                    for x, y in centers)
+        result['brute_force_ms'] = measure(count_each, max(1, repeats // 10)) * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--zones", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--points", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--brute-force", action="store_true", help="also measures the zones tested one by one")
+    args = parser.parse_args()
+
+    for zones, points in itertools.product(args.zones, args.points):
+        print(json.dumps(run(zones, points, repeats=args.repeats, brute_force=args.brute_force)))
+
+
+if __name__ == '__main__':
+    main()
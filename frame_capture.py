@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from metrics import Metrics
+
+"""FrameCapture reads the video source on its own thread and always gives the newest frame"""
+
+
+class FrameCapture:
+    def __init__(self, source, buffer_size=2, reconnect_wait=2):
+        self._source = source
+        self._reconnect_wait = reconnect_wait
+        # Ring buffer of (index, capture time, frame), the oldest frames are overwritten
+        self._buffer = deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.read_errors = 0
+        self.reconnections = 0
+        self.last_frame_index = -1
+        self.last_frame_time = None
+        self._metrics = Metrics()
+
+        self._cap = self._open()
+        self.width = self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+        self._running = True
+        self._thread = threading.Thread(target=self._capture_frames, daemon=True)
+        self._thread.start()
+
+    def _open(self):
+        cap = cv2.VideoCapture(self._source)
+        # The OpenCV buffer is kept as small as possible, the frames are buffered here
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _reconnect(self):
+        """releases the stream and opens it again after a while"""
+        print(f"Capture Error, reconnecting to {self._source} in {self._reconnect_wait} seconds")
+        self._cap.release()
+        time.sleep(self._reconnect_wait)
+        self._cap = self._open()
+        self.reconnections += 1
+        self._metrics.count("capture.reconnections")
+
+    def _capture_frames(self):
+        """grabs frames as soon as they are available, if the ring is full the oldest frame is dropped"""
+        while self._running:
+            started = time.perf_counter()
+            ret, frame = self._cap.read()
+            if not ret or frame is None:
+                self.read_errors += 1
+                self._metrics.count("capture.read_errors")
+                if self._running:
+                    self._reconnect()
+                continue
+
+            self._metrics.observe("capture.read", time.perf_counter() - started)
+            self._metrics.count("capture.frames")
+            with self._condition:
+                if len(self._buffer) == self._buffer.maxlen:
+                    self.frames_dropped += 1
+                    self._metrics.count("capture.frames_dropped")
+                self._buffer.append((self.frames_captured, time.time(), frame))
+                self.frames_captured += 1
+                self._condition.notify_all()
+
+    def read(self, timeout=1.0):
+        """returns the newest frame not read yet, the older ones are dropped.
+        Returns (False, None) if there isn't a new frame before the timeout"""
+        with self._condition:
+            if not self._condition.wait_for(lambda: len(self._buffer) > 0, timeout):
+                return False, None
+            self.last_frame_index, self.last_frame_time, frame = self._buffer.pop()
+            if self._buffer:
+                self.frames_dropped += len(self._buffer)
+                self._metrics.count("capture.frames_dropped", len(self._buffer))
+                self._buffer.clear()
+        return True, frame
+
+    def stats(self):
+        """counters of the capture stage"""
+        return {'captured': self.frames_captured,
+                'dropped': self.frames_dropped,
+                'read_errors': self.read_errors,
+                'reconnections': self.reconnections}
+
+    def release(self):
+        self._running = False
+        self._thread.join(timeout=self._reconnect_wait + 1)
+        self._cap.release()
@@ -0,0 +1,129 @@
+import sys
+import time
+
+import cv2
+import pygame
+
+from metrics import Metrics
+from pygame_interface import PygameInterface
+from zone import Zone
+
+"""Graphic interface of the system, it observes the pipeline and draws it at most max_fps times per second"""
+
+
+zone_drawing = False
+points = []
+
+
+def pygame_event_actions(interface, pipeline, controller=None, camera=0):
+    """manage possible inputs and commands"""
+    global zone_drawing, points
+    for event in pygame.event.get():
+        # Quits if is pressed q
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_q:
+                pygame.quit()
+                pipeline.release()
+                cv2.destroyAllWindows()
+                sys.exit()
+            # if the controller was initialized, manages the movement of the camera
+            elif event.key == pygame.K_w and controller != None:
+                controller.move_up()
+            elif event.key == pygame.K_d and controller != None:
+                controller.move_right()
+            elif event.key == pygame.K_s and controller != None:
+                controller.move_down()
+            elif event.key == pygame.K_a and controller != None:
+                controller.move_left()
+            elif event.key == pygame.K_UP and controller != None:
+                controller.zoom_in()
+            elif event.key == pygame.K_DOWN and controller != None:
+                controller.zoom_out()
+        if event.type == pygame.KEYUP and controller != None:
+            controller.stop()
+        # Removes the zone clicked with the right button
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 3:
+            if not zone_drawing:
+                zone = Zone.zone_at(event.pos, camera)
+                if zone is not None:
+                    Zone.remove_zone(zone, interface)
+            continue
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            # Starts zone drawing or stops it if at least 3 points are pressed
+            if interface.buttons[interface.new_zone_button].rect.collidepoint(event.pos):
+                if not zone_drawing:
+                    print("\nStarted Zone Draw")
+                    interface.update_text(interface.new_zone_button)
+                    zone_drawing = True
+                    points = []
+                elif len(points) >= 3:
+                    print("New Zone Drawn\n")
+                    Zone.create_zone(points, interface, camera=camera)
+                    zone_drawing = False
+                    interface.update_text(interface.new_zone_button)
+
+            # Start video tracking
+            elif interface.buttons[interface.start_tracking_button].rect.collidepoint(event.pos):
+                tracker = pipeline.tracker
+                if not tracker.is_started():
+                    print("Started video tracking\n")
+                    tracker.start()
+                    interface.update_text(interface.start_tracking_button)
+                else:
+                    print("Stopped video tracking")
+                    tracker.stop()
+                    interface.update_text(interface.start_tracking_button)
+
+            elif interface.buttons[interface.load_zones_button].rect.collidepoint(event.pos):
+                Zone.load_zones(interface)
+                interface.update_text(interface.load_zones_button)
+
+            # Saves the current zones on the interface in zones.json
+            elif interface.buttons[interface.save_zones_button].rect.collidepoint(event.pos):
+                Zone.save_zones()
+                interface.update_text(interface.save_zones_button)
+
+            # Deletes the current zones from the interface
+            elif interface.buttons[interface.delete_zones_button].rect.collidepoint(event.pos):
+                Zone.delete_zones(interface)
+                interface.update_text(interface.delete_zones_button)
+
+
+            # Adds point to the zone to draw if the zone drawing is started
+            # and it's neither on the dead zone or the zone recap
+            elif (zone_drawing
+                  and not interface.dead_zone.collidepoint(event.pos)
+                  and not interface.zones_recap.collidepoint(event.pos)):
+                print(f"{event.pos} added to the Zone")
+                points.append(event.pos)
+                interface.add_point(event.pos)
+
+
+def run_gui(pipeline, controller=None, max_fps=15, camera=0):
+    """runs the pipeline of all the cameras and shows camera on the pygame interface"""
+    # Created Pygame Interface
+    cap = pipeline.captures[camera]
+    interface = PygameInterface("Video Tracking System", cap.width, cap.height)
+    # Only the zones of the camera shown are drawn and created from the interface
+    Zone.interface_camera = pipeline.cameras[camera]
+    tracker = pipeline.tracker
+    metrics = Metrics()
+    last_draw = 0
+
+    while True:
+        pygame_event_actions(interface, pipeline, controller, Zone.interface_camera)
+        # Each step processes the newest frame of one of the cameras
+        if pipeline.step() != camera:
+            continue
+        frame = pipeline.frames[camera]
+
+        # The interface is drawn only if enough time passed, the pipeline runs on every frame
+        now = time.monotonic()
+        if now - last_draw >= 1 / max_fps:
+            last_draw = now
+            with metrics.timer("render"):
+                if tracker.is_started():
+                    for box in tracker.camera(Zone.interface_camera).boxes:
+                        interface.create_box(*box)
+                # Adjust frame to pygame screen, the BGR frame is drawn without conversions
+                interface.adjust_frame(frame)
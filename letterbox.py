@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+
+"""Letterbox resizes the frames to the square used by the model keeping the proportions,
+the boxes found by the model are mapped back to the frame coordinates"""
+
+
+class Letterbox:
+    PAD_COLOR = 114
+
+    def __init__(self, size=640):
+        self.size = size
+
+    def transform(self, width, height):
+        """returns (scale_x, scale_y, pad_x, pad_y) used to fit a width x height image in the square"""
+        scale = min(self.size / width, self.size / height)
+        new_width = min(self.size, max(1, round(width * scale)))
+        new_height = min(self.size, max(1, round(height * scale)))
+        pad_x = (self.size - new_width) // 2
+        pad_y = (self.size - new_height) // 2
+        # The scales are computed from the rounded sizes so the mapping back is exact
+        return new_width / width, new_height / height, pad_x, pad_y
+
+    def apply(self, image, out):
+        """writes the image resized and padded in out (size, size, 3), returns the transform"""
+        height, width = image.shape[:2]
+        transform = scale_x, scale_y, pad_x, pad_y = self.transform(width, height)
+        new_width, new_height = round(width * scale_x), round(height * scale_y)
+
+        if (new_width, new_height) == (width, height):
+            resized = image
+        else:
+            interpolation = cv2.INTER_AREA if scale_x < 1 else cv2.INTER_LINEAR
+            resized = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+
+        # Only the borders are filled, the image is copied once
+        out[:pad_y] = self.PAD_COLOR
+        out[pad_y + new_height:] = self.PAD_COLOR
+        out[pad_y:pad_y + new_height, :pad_x] = self.PAD_COLOR
+        out[pad_y:pad_y + new_height, pad_x + new_width:] = self.PAD_COLOR
+        out[pad_y:pad_y + new_height, pad_x:pad_x + new_width] = resized
+        return transform
+
+    @staticmethod
+    def unmap(boxes, transform, offset=(0, 0)):
+        """moves the boxes (n, >=4) x1, y1, x2, y2 from the square to the image coordinates,
+        offset is the position of the image in the frame if the image was a crop"""
+        scale_x, scale_y, pad_x, pad_y = transform
+        offset_x, offset_y = offset
+        boxes = np.array(boxes, dtype=np.float32, copy=True)
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad_x) / scale_x + offset_x
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad_y) / scale_y + offset_y
+        return boxes
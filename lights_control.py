@@ -1,28 +1,394 @@
 import asyncio
-import multiprocessing
-import sys
+import collections
+import functools
+import threading
 import time
 
 from xknx import XKNX
+from xknx.core import XknxConnectionState
 from xknx.devices import Switch
+from xknx.dpt import DPTBinary
+from xknx.io import ConnectionConfig
+from xknx.telegram import GroupAddress, Telegram, TelegramDirection
+from xknx.telegram.apci import GroupValueRead, GroupValueResponse, GroupValueWrite
+
+from metrics import Metrics
+from tracing import Tracer
+
+"""LightGateway is a Singleton that keeps one KNX connection open for all the lights
+and a cache of their state on the bus. The telegrams wait in the gateway, at most one for each light,
+and are sent within the rate the bus can carry, the switch ons before the switch offs"""
+
+
+class LightGateway:
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, 'instance'):
+            cls.instance = super().__new__(cls)
+        return cls.instance
+
+    def __init__(self, connection_config: ConnectionConfig = None, reconnect_wait=3, read_timeout=2, rate_limit=20):
+        """the states of the lights are read when the connection is opened,
+        waiting at most read_timeout seconds plus the time the bus needs for the reads.
+        At most rate_limit telegrams per second are sent on the bus, reads included, 0 is no limit"""
+        # The connection is opened only once, even if the Singleton is requested again
+        if hasattr(self, "_loop"):
+            return
+        if connection_config is None:
+            connection_config = ConnectionConfig(auto_reconnect=True, auto_reconnect_wait=reconnect_wait)
+        self._connection_config = connection_config
+        self._reconnect_wait = reconnect_wait
+        self._read_timeout = read_timeout
+        self.rate_limit = rate_limit
+        self._xknx = None
+        self._switches = {}
+        # Lights by group address, both the switch and the status address
+        self._lights = {}
+        # State of each light on the bus by switch address, from the reads, the telegrams seen and the ones sent
+        self.states = {}
+        # Status addresses read and not answered yet
+        self._unread = set()
+        self._state_received = asyncio.Event()
+        # (group address, value) of the switch being sent, confirmed is set when xknx has sent it on the bus
+        self._in_flight = None
+        self._confirmed = False
+        self._metrics = Metrics()
+        self._tracer = Tracer()
+
+        # The connection lives on a dedicated event loop so the video loop is never blocked
+        self._loop = asyncio.new_event_loop()
+        # (light, new_state, queued, trace) waiting to be sent by group address, a newer switch of the light
+        # replaces the one waiting. The switch ons are sent first, in the order they were queued
+        self._telegrams = {True: collections.OrderedDict(), False: collections.OrderedDict()}
+        self._telegram_queued = asyncio.Event()
+        # time.monotonic() of the telegrams sent in the last second, for the bus load
+        self._sent_times = collections.deque()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.create_task(self._send_telegrams())
+        self._loop.run_forever()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def send(self, light, new_state, trace=None):
+        """queues the switch of the light without waiting for the telegram to be sent,
+        the trace of the frame that caused the switch is written when the telegram is sent"""
+        self._loop.call_soon_threadsafe(self._put, light, new_state, trace)
+
+    def register(self, lights):
+        """the states of the lights are read from the bus and kept current with the telegrams of the
+        other devices, e.g. a wall switch"""
+        self._loop.call_soon_threadsafe(self._register, list(lights))
+
+    def unregister(self, lights):
+        """the state of the lights is no longer kept"""
+        self._loop.call_soon_threadsafe(self._unregister, list(lights))
+
+    def _register(self, lights):
+        for light in lights:
+            self._lights[light.address] = light
+            self._lights[light.status_address] = light
+        # The lights added when the connection is open are read now, the others when it opens
+        if self._xknx is not None:
+            self._loop.create_task(self._read_states(lights))
+
+    def _unregister(self, lights):
+        for light in lights:
+            for address in (light.address, light.status_address):
+                if self._lights.get(address) is light:
+                    del self._lights[address]
+            self.states.pop(light.address, None)
+            self._release_switch(light)
+
+    def _release_switch(self, light):
+        """removes the Switch of the light from xknx if the light isn't registered anymore,
+        the telegrams still queued for it create it again and release it when they are sent"""
+        if self._lights.get(light.address) is light:
+            return
+        switch = self._switches.pop(light.address, None)
+        if switch is not None:
+            switch.shutdown()
+
+    def send_many(self, telegrams):
+        """queues many (light, new_state) switches with a single call to the event loop"""
+        self._loop.call_soon_threadsafe(self._put_many, list(telegrams))
+
+    def _put_many(self, telegrams):
+        for light, new_state in telegrams:
+            self._put(light, new_state)
+
+    def _put(self, light, new_state, trace=None):
+        queued = time.time()
+        for telegrams in self._telegrams.values():
+            waiting = telegrams.pop(light.address, None)
+            if waiting is not None:
+                # The switch not sent yet is replaced, e.g. on->off->on sends only on.
+                # The time it was queued is kept, the latency is from the first request
+                self._metrics.count("knx.telegrams_coalesced")
+                waiting[0].sent(None)
+                queued = waiting[2]
+        # The time each telegram was queued is kept to measure how long it waited
+        self._telegrams[bool(new_state)][light.address] = (light, new_state, queued, trace)
+        self._telegram_queued.set()
+        self._metrics.gauge("knx.queue_depth", self.queue_depth())
+
+    def queue_depth(self):
+        return len(self._telegrams[True]) + len(self._telegrams[False])
+
+    async def _next_telegram(self):
+        """waits for a telegram and returns the oldest switch on, or the oldest switch off if there isn't one"""
+        while not self.queue_depth():
+            self._telegram_queued.clear()
+            await self._telegram_queued.wait()
+        telegrams = self._telegrams[True] or self._telegrams[False]
+        return telegrams.popitem(last=False)[1]
+
+    def _bus_load(self):
+        """counts the telegram sent and updates the telegrams per second of the last second"""
+        now = time.monotonic()
+        self._sent_times.append(now)
+        while now - self._sent_times[0] > 1:
+            self._sent_times.popleft()
+        self._metrics.gauge("knx.telegrams_per_second", len(self._sent_times))
+        if self.rate_limit:
+            self._metrics.gauge("knx.bus_load", len(self._sent_times) / self.rate_limit)
+
+    async def _connect(self):
+        """opens the connection to the KNX interface, tries again until it's possible"""
+        while self._xknx is None:
+            xknx = XKNX(connection_config=self._connection_config, rate_limit=self.rate_limit)
+            # The telegrams of the other devices keep the state cache current
+            xknx.telegram_queue.register_telegram_received_cb(self._telegram_received)
+            # xknx only logs the telegrams it failed to send, the ones sent are seen here
+            xknx.telegram_queue.register_telegram_received_cb(self._telegram_sent, match_for_outgoing=True)
+            xknx.connection_manager.register_connection_state_changed_cb(self._connection_changed)
+            try:
+                await xknx.start()
+                self._xknx = xknx
+                self._switches = {}
+                self._metrics.count("knx.connections")
+                print("xknx connected")
+                # The states could have changed while the connection was closed
+                self.states.clear()
+                await self._read_states(set(self._lights.values()))
+            except Exception as e:
+                print("xknx Error:", e, f"- retrying in {self._reconnect_wait} seconds")
+                try:
+                    await xknx.stop()
+                except Exception:
+                    pass
+                await asyncio.sleep(self._reconnect_wait)
+        # If the tunnel was lost xknx reconnects by itself, waits until it's done
+        await self._xknx.connection_manager.connected.wait()
+
+    async def _connection_changed(self, state):
+        """the states are read again each time xknx opens the tunnel again by itself,
+        they could have changed while the connection was lost"""
+        # The first connection is read by _connect, self._xknx is set after it
+        if state == XknxConnectionState.CONNECTED and self._xknx is not None:
+            self._metrics.count("knx.connections")
+            self.states.clear()
+            self._loop.create_task(self._read_states(set(self._lights.values())))
+
+    async def _read_states(self, lights):
+        """sends a group read to the status address of all the lights at once and waits for the answers"""
+        addresses = {light.status_address for light in lights}
+        if not addresses:
+            return
+        self._unread |= addresses
+        for address in addresses:
+            self._xknx.telegrams.put_nowait(Telegram(GroupAddress(address), payload=GroupValueRead()))
+        self._metrics.count("knx.reads", len(addresses))
+        timeout = self._read_timeout + (len(addresses) / self._xknx.rate_limit if self._xknx.rate_limit else 0)
+        try:
+            await asyncio.wait_for(self._wait_states(addresses), timeout)
+        except asyncio.TimeoutError:
+            unanswered = addresses & self._unread
+            self._unread -= unanswered
+            print(f"xknx: {len(unanswered)} light states not read")
+
+    async def _wait_states(self, addresses):
+        while addresses & self._unread:
+            self._state_received.clear()
+            await self._state_received.wait()
+
+    async def _telegram_received(self, telegram):
+        """updates the state of the light when its switch or its status is written or read on the bus"""
+        address = str(telegram.destination_address)
+        light = self._lights.get(address)
+        if light is None or not isinstance(telegram.payload, (GroupValueWrite, GroupValueResponse)):
+            return
+        value = telegram.payload.value
+        if not isinstance(value, DPTBinary):
+            return
+        state = bool(value.value)
+        self._unread.discard(address)
+        self._state_received.set()
+        if self.states.get(light.address) != state:
+            self.states[light.address] = state
+            self._metrics.count("knx.state_changes")
+        light.bus_update(state)
+
+    async def _telegram_sent(self, telegram):
+        """called by xknx for each telegram, after it was sent on the bus if it's outgoing"""
+        if telegram.direction != TelegramDirection.OUTGOING or not isinstance(telegram.payload, GroupValueWrite):
+            return
+        value = telegram.payload.value
+        if isinstance(value, DPTBinary) and (str(telegram.destination_address), value.value) == self._in_flight:
+            self._confirmed = True
+
+    def _requeue(self, light, new_state, queued, trace):
+        """puts back a switch that wasn't sent, first of its priority, unless the light has a newer one waiting"""
+        if any(light.address in telegrams for telegrams in self._telegrams.values()):
+            light.sent(None)
+            return
+        telegrams = self._telegrams[bool(new_state)]
+        telegrams[light.address] = (light, new_state, queued, trace)
+        telegrams.move_to_end(light.address, last=False)
+        self._telegram_queued.set()
+
+    def _switch(self, light):
+        """returns the Switch of the light, one for each address on the connection"""
+        if light.address not in self._switches:
+            # The state is kept by the gateway, the Switch doesn't read it again
+            self._switches[light.address] = Switch(self._xknx, f"light {light.address}",
+                                                   light.address, light.status_address, sync_state=False)
+        return self._switches[light.address]
+
+    async def _send_telegrams(self):
+        """sends the queued telegrams one at a time, xknx keeps them within the rate limit.
+        If a telegram isn't confirmed it's queued again and sent after reconnecting"""
+        while True:
+            light, new_state, queued, trace = await self._next_telegram()
+            dequeued = time.time()
+            self._metrics.gauge("knx.queue_depth", self.queue_depth())
+            self._metrics.observe("knx.queue_wait", dequeued - queued)
+            try:
+                await self._connect()
+                if self.states.get(light.address) == bool(new_state):
+                    # The light is already in this state on the bus, the telegram isn't needed
+                    self._metrics.count("knx.telegrams_suppressed")
+                    light.sent(bool(new_state))
+                    continue
+                s = self._switch(light)
+                started = time.time()
+                self._in_flight = (light.address, int(bool(new_state)))
+                self._confirmed = False
+                if new_state:
+                    await s.set_on()
+                else:
+                    await s.set_off()
+                # Waits until xknx has sent the telegram, the telegrams not sent yet stay in the gateway queue
+                await self._xknx.telegrams.join()
+                self._in_flight = None
+                if not self._confirmed:
+                    raise ConnectionError(f"telegram to {light.address} not sent")
+                sent = time.time()
+                self._metrics.observe("knx.send", sent - started)
+                self._bus_load()
+                if trace is not None:
+                    trace = trace.branch()
+                    trace.add("knx_queue", queued, dequeued)
+                    trace.add("knx_send", started, sent)
+                    self._tracer.write(trace, address=light.address, on=int(bool(new_state)))
+                self._metrics.count("knx.telegrams_on" if new_state else "knx.telegrams_off")
+                print(f"{light.address}", "on" if new_state else "off")
+                self.states[light.address] = bool(new_state)
+                light.sent(bool(new_state))
+                self._release_switch(light)
+            except Exception as e:
+                # The switch is sent again after reconnecting, if the light wasn't switched again meanwhile
+                self._in_flight = None
+                self._metrics.count("knx.errors")
+                print("xknx Error:", e)
+                self._requeue(light, new_state, queued, trace)
+                await self._disconnect()
+
+    async def _disconnect(self):
+        xknx, self._xknx = self._xknx, None
+        if xknx is not None:
+            try:
+                await xknx.stop()
+            except Exception:
+                pass
+        await asyncio.sleep(self._reconnect_wait)
+
+
+class LightScheduler:
+    """LightScheduler is a Singleton that keeps the delayed switch offs of all the lights.
+    The timers are kept in the heap of the gateway event loop, so there isn't a process
+    or a thread for each light and only the pending timers use memory"""
+
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, 'instance'):
+            cls.instance = super().__new__(cls)
+        return cls.instance
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        if hasattr(self, "_loop"):
+            return
+        self._loop = loop
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._timers)
+
+    def schedule(self, key, delay, callback):
+        """calls callback after delay seconds, replaces the timer already scheduled for the key"""
+        self._loop.call_soon_threadsafe(self._schedule, key, delay, callback)
+
+    def cancel(self, key):
+        """removes the timer of the key if it's still pending"""
+        self._loop.call_soon_threadsafe(self._cancel, key)
+
+    def _schedule(self, key, delay, callback):
+        self._cancel(key)
+        self._timers[key] = self._loop.call_later(delay, self._expire, key, callback)
+
+    def _cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _expire(self, key, callback):
+        self._timers.pop(key, None)
+        callback()
 
 
 class Light:
     lights = []
+    # Seconds the light stays on after the zone becomes empty
+    hold_time = 8
 
-    def __init__(self):
-        self.address = "0/0/" + str(len(Light.lights) + 1)
-        self.status_address = "0/1/" + str(len(Light.lights) + 1)
-        self._stop_light_off_event = multiprocessing.Event()
-        self._state = multiprocessing.Event()
-
-        self._light_off_process = multiprocessing.Process(target=self.light_off_timer)
-        self._light_off_process.daemon = True
-        self._light_off_process.start()
+    def __init__(self, hold_time=None, address=None, status_address=None, switch_off=True):
+        """if the addresses are not given the lowest free ones are assigned,
+        with switch_off the light is switched off at the start. The light is removed with dispose"""
+        self.address, self.status_address = self._allocate(address, status_address)
+        if hold_time is not None:
+            self.hold_time = hold_time
+        self._gateway = LightGateway()
+        self._scheduler = LightScheduler(self._gateway.loop)
+        self._state = threading.Event()
+        # Last state sent to the gateway, the state is updated when the telegram is sent
+        self._requested_state = None
+        # Telegrams sent to the gateway and not sent on the bus yet
+        self._pending = 0
+        # True while the switch off is waiting for the hold time
+        self._off_pending = False
+        # Number of the last switch off requested, a timer of an older one is ignored
+        self._off_generation = 0
+        self._lock = threading.Lock()
 
         Light.lights.append(self)
-        # The light is switched off at the start
-        asyncio.run(self.lights_update(0))
+        # The state on the bus is read and kept by the gateway, the light is switched off
+        # at the start if it isn't already off. create_lights does both for many lights at once
+        if switch_off:
+            self._gateway.register([self])
+            self.lights_update(0)
 
     @property
     def state(self):
@@ -40,53 +406,114 @@ class Light:
         else:
             self._state.clear()
 
-    def light_on(self):
-        """switch on the light if the light is off, if the timer is still running, set the state"""
-        if self.state == "OFF":
-            asyncio.run(self.lights_update(1))
-        elif not self._stop_light_off_event.is_set():
-            self._stop_light_off_event.set()
-
-    def light_off(self):
-        """if the light is on, starts a 3 seconds timer before switching off the light """
-        if self.state == "ON":
-            # Starts timer
-            self._stop_light_off_event.clear()
-
-    def light_off_timer(self):
-        """8 seconds timer that starts if the event is cleared.
-         After each second check if the light tried to be switched on"""
-        while True:
-            seconds_passed = 0
-            # if the event was cleared
-            while not self._stop_light_off_event.is_set():
-                time.sleep(1)
-                seconds_passed += 1
-                # if the light wasn't requested to be switched on and 8 seconds have passed
-                if not self._stop_light_off_event.is_set() and seconds_passed == 8:
-                    asyncio.run(self.lights_update(0))
-                    # Becomes idle
-                    self._stop_light_off_event.set()
-                    seconds_passed = 0
-
-    async def lights_update(self, new_state):
-        """turns the light if the queue is empty. The queue is not empty when the switching off has to be stopped"""
-        try:
-            async with XKNX() as xknx:
-                s = Switch(xknx, "switch", self.address, self.status_address)
-                if new_state:
-                    await s.set_on()
-                    print(f"{self.address}", "on")
-                    self.state = True
-                else:
-                    await s.set_off()
-                    print(f"{self.address}", "off")
-                    self.state = False
+    def light_on(self, trace=None):
+        """switch on the light if the light is off, if the timer is still running, stops it"""
+        with self._lock:
+            if not self._requested_state:
+                self.lights_update(1, trace)
+            elif self._off_pending:
+                self._off_pending = False
+                self._scheduler.cancel(self)
+
+    def light_off(self, trace=None):
+        """if the light is on, starts the hold time timer before switching off the light"""
+        with self._lock:
+            if self._requested_state and not self._off_pending:
+                self._off_pending = True
+                self._off_generation += 1
+                self._scheduler.schedule(self, self.hold_time,
+                                         functools.partial(self._light_off_timer_expired, trace, time.time(),
+                                                           self._off_generation))
+
+    def _light_off_timer_expired(self, trace=None, requested=None, generation=None):
+        """switch off the light if it wasn't requested to be switched on during the hold time,
+        nor switched off by someone else. The timer of an older switch off can expire after it was cancelled,
+        if it was already due, and it's ignored"""
+        with self._lock:
+            if self._off_pending and generation == self._off_generation:
+                self._off_pending = False
+                if not self._requested_state:
+                    return
+                if trace is not None:
+                    trace = trace.branch()
+                    trace.add("hold", requested, time.time())
+                self.lights_update(0, trace)
+
+    def bus_update(self, state):
+        """called by the gateway when the bus shows the state of the light, also if it was changed
+        by someone else. If there aren't telegrams of this light still to send, the light keeps
+        that state until the zone changes"""
+        with self._lock:
+            self.state = state
+            if not self._pending:
+                self._requested_state = state
+
+    def sent(self, state):
+        """called by the gateway when the telegram is sent, or when it's not needed because the light
+        already had the state on the bus. state is None if the telegram was replaced by a newer one"""
+        with self._lock:
+            self._pending -= 1
+            if state is not None:
+                self.state = state
 
-        except Exception as e:
-            print("xknx Error:", e)
-            sys.exit()
+    @property
+    def pending(self):
+        """switches of the light not sent on the bus yet"""
+        return self._pending
+
+    def _request(self, new_state):
+        self._requested_state = bool(new_state)
+        self._pending += 1
+
+    def lights_update(self, new_state, trace=None):
+        """sends the new state of the light through the shared gateway"""
+        self._request(new_state)
+        self._gateway.send(self, new_state, trace)
+
+    def dispose(self, switch_off=True):
+        """removes the light: its timer is cancelled, its state is no longer kept and its addresses
+        can be assigned to a new light. With switch_off the light is switched off if it's on"""
+        with self._lock:
+            # A timer already expired finds nothing pending and doesn't switch the light
+            self._off_pending = False
+            self._scheduler.cancel(self)
+            if switch_off and self._requested_state:
+                self.lights_update(0)
+        self._gateway.unregister([self])
+        if self in Light.lights:
+            Light.lights.remove(self)
+
+    @classmethod
+    def _allocate(cls, address, status_address):
+        """returns the addresses of a new light, the lowest free ones replace the addresses not given
+        or already used by another light, so two lights never share an address"""
+        used = {used for light in cls.lights for used in (light.address, light.status_address)}
+        if address in used or status_address in used:
+            print(f"Address {address} already used, a free address is assigned")
+            address = status_address = None
+        if not address or not status_address:
+            number = 1
+            while f"0/0/{number}" in used or f"0/1/{number}" in used:
+                number += 1
+            address = address or f"0/0/{number}"
+            status_address = status_address or f"0/1/{number}"
+        return address, status_address
+
+    @classmethod
+    def create_lights(cls, configurations):
+        """creates a light for each (hold_time, address, status_address),
+        all the lights are switched off with one request to the gateway"""
+        lights = [cls(hold_time, address, status_address, switch_off=False)
+                  for hold_time, address, status_address in configurations]
+        for light in lights:
+            light._request(0)
+        # The states are read in one bulk, the lights already off on the bus get no telegram
+        LightGateway().register(lights)
+        LightGateway().send_many((light, 0) for light in lights)
+        return lights
 
     @classmethod
     def clear_lights(cls):
-        cls.lights = []
+        """disposes all the lights"""
+        for light in list(cls.lights):
+            light.dispose()
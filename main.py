@@ -1,145 +1,116 @@
-import ast
-import ctypes
-import sys
-
-import cv2
-import pygame
-
+import argparse
+import signal
+
+from frame_capture import FrameCapture
+from lights_control import LightGateway
+from metrics import Metrics
+from pipeline import Pipeline
+from replay import DetectionRecorder
+from tracing import Tracer
 from PTZ.camera import Camera
 from PTZ.ptz_controller import CameraController
 from video_tracker import VideoTracker
-from pygame_interface import PygameInterface
 from zone import Zone
 
 
-def get_camera_id():
-    """get camera rtsp URL from camera_id.txt, 0 is the webcam"""
+def get_camera_ids():
+    """get the cameras rtsp URLs from camera_id.txt, one for each line, 0 is the webcam"""
+    camera_ids = []
     with open("camera_id.txt", "r") as file:
-        camera_id = file.readline()
-        # if the camera is local, it's an int value, otherwise it's a string
-        if len(camera_id) <= 1: camera_id = int(camera_id)
+        for camera_id in file:
+            camera_id = camera_id.strip()
+            if not camera_id:
+                continue
+            # if the camera is local, it's an int value, otherwise it's a string
+            if camera_id.isdigit(): camera_id = int(camera_id)
+            camera_ids.append(camera_id)
 
     # PTZ CAM
-    if camera_id == "rtsp://192.168.1.123/12":
+    controller = None
+    if "rtsp://192.168.1.123/12" in camera_ids:
         mycam = Camera("192.168.1.123", "admin", "Casa1234")
         controller = CameraController(mycam)
-        return camera_id, controller
-    return camera_id, None
-
-
-zone_drawing = False
-point = []
-
-
-def pygame_event_actions(interface, tracker, controller=None):
-    """manage possible inputs and commands"""
-    global zone_drawing, points
-    for event in pygame.event.get():
-        # Quits if is pressed q
-        if event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_q:
-                pygame.quit()
-                cap.release()
-                cv2.destroyAllWindows()
-                sys.exit()
-            # if the controller was initialized, manages the movement of the camera
-            elif event.key == pygame.K_w and controller != None:
-                controller.move_up()
-            elif event.key == pygame.K_d and controller != None:
-                controller.move_right()
-            elif event.key == pygame.K_s and controller != None:
-                controller.move_down()
-            elif event.key == pygame.K_a and controller != None:
-                controller.move_left()
-            elif event.key == pygame.K_UP and controller != None:
-                controller.zoom_in()
-            elif event.key == pygame.K_DOWN and controller != None:
-                controller.zoom_out()
-        if event.type == pygame.KEYUP and controller != None:
-            controller.stop()
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            # Starts zone drawing or stops it if at least 3 points are pressed
-            if interface.buttons[interface.new_zone_button].rect.collidepoint(event.pos):
-                if not zone_drawing:
-                    print("\nStarted Zone Draw")
-                    interface.update_text(interface.new_zone_button)
-                    zone_drawing = True
-                    points = []
-                elif len(points) >= 3:
-                    print("New Zone Drawn\n")
-                    Zone.create_zone(points, interface)
-                    zone_drawing = False
-                    interface.update_text(interface.new_zone_button)
-
-            # Start video tracking
-            elif interface.buttons[interface.start_tracking_button].rect.collidepoint(event.pos):
-                if not tracker.is_started():
-                    print("Started video tracking\n")
-                    tracker.start()
-                    interface.update_text(interface.start_tracking_button)
-                else:
-                    print("Stopped video tracking")
-                    tracker.stop()
-                    interface.update_text(interface.start_tracking_button)
-
-            elif interface.buttons[interface.load_zones_button].rect.collidepoint(event.pos):
-                with open("zones.txt", "r") as file:
-                    for line in file:
-                        # Reads lines from file, evaluate them as lists and removes repetitions
-                        l = ast.literal_eval(line)
-                        Zone.create_zone(l, interface)
-                        interface.update_text(interface.load_zones_button)
-
-            # Saves the current zones on the interface in zones.txt
-            elif interface.buttons[interface.save_zones_button].rect.collidepoint(event.pos):
-                Zone.save_zones()
-                interface.update_text(interface.save_zones_button)
-
-            # Deletes the current zones from the interface
-            elif interface.buttons[interface.delete_zones_button].rect.collidepoint(event.pos):
-                Zone.delete_zones(interface)
-                interface.update_text(interface.delete_zones_button)
-
-
-            # Adds point to the zone to draw if the zone drawing is started
-            # and it's neither on the dead zone or the zone recap
-            elif (zone_drawing
-                  and not interface.dead_zone.collidepoint(event.pos)
-                  and not interface.zones_recap.collidepoint(event.pos)):
-                print(f"{event.pos} added to the Zone")
-                points.append(event.pos)
-                interface.add_point(event.pos)
+    return camera_ids, controller
+
+
+def run_headless(pipeline):
+    """runs capture, detection, zones and lights of all the cameras without any interface"""
+    pipeline.tracker.start()
+    print("Started video tracking\n")
+
+    # A service is stopped with SIGTERM, it's handled like Ctrl+C
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            pipeline.step()
+    except KeyboardInterrupt:
+        print("Stopped video tracking")
+    finally:
+        # The captures are released and the recording is completed also if the loop failed
+        pipeline.release()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Smart Lighting with KNX and Video Tracking")
+    parser.add_argument("--headless", action="store_true",
+                        help="runs without the interface, the zones are loaded from the zones file")
+    parser.add_argument("--zones", default="zones.json", help="zones file loaded at startup in headless mode")
+    parser.add_argument("--gui-fps", type=float, default=15, help="maximum frames per second drawn by the interface")
+    parser.add_argument("--gui-camera", type=int, default=0, help="camera shown on the interface")
+    parser.add_argument("--metrics-file", default=None, help="file where the metrics are written as JSON")
+    parser.add_argument("--metrics-interval", type=float, default=10, help="seconds between the writes of the metrics file")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serves the metrics as JSON on http://127.0.0.1:<port>/metrics")
+    parser.add_argument("--trace-file", default=None,
+                        help="file where the trace of each telegram, from the capture of the frame, is appended")
+    parser.add_argument("--workers", type=int, default=5, help="processes that run the detection model")
+    parser.add_argument("--batch-size", type=int, default=1, help="frames each worker detects at once")
+    parser.add_argument("--max-wait", type=float, default=0.02,
+                        help="seconds a worker waits for its batch to fill before running the model")
+    parser.add_argument("--imgsz", type=int, default=640,
+                        help="side in pixels of the square the frames are resized to for the model, e.g. 320 or 416")
+    parser.add_argument("--report-interval", type=float, default=30,
+                        help="seconds between the throughput reports of the cameras")
+    parser.add_argument("--record", default=None,
+                        help="file where the people detected are recorded, to replay them with replay.py")
+    parser.add_argument("--knx-rate-limit", type=int, default=20,
+                        help="maximum telegrams per second sent on the KNX bus, 0 is no limit")
+    return parser.parse_args()
 
 
 if __name__ == '__main__':
-    # Started tracker
-    tracker = VideoTracker()
-
-    # Get screen resolution
-    #user32 = ctypes.windll.user32
-    #screen_width = user32.GetSystemMetrics(0)
-    #screen_height = user32.GetSystemMetrics(1)
-
-    # Opencv video capture
-    camera_id, controller = get_camera_id()
-    cap = cv2.VideoCapture(camera_id)
-    screen_width, screen_height = cap.get(cv2.CAP_PROP_FRAME_WIDTH),cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-
-    # Created Pygame Interface
-    interface = PygameInterface("Video Tracking System", screen_width, screen_height)
-
-    while True:
-        # Read video frame from capture
-        ret, frame = cap.read()
-        #frame = cv2.resize(frame, (screen_width, screen_height))
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-        # Adjust frame to pygame screen
-        interface.adjust_frame(frame_rgb)
-        pygame_event_actions(interface, tracker, controller)
-
-        # If there aren't people detected, after many frames
-        # sends an empty list to the zone control
-        if tracker.is_started():
-            results = tracker.object_detection(frame, interface)
-            Zone.update_zone(results)
+    args = parse_arguments()
+
+    # Latencies and counters of each stage, exported only if requested
+    if args.metrics_file is not None:
+        Metrics().start_file_dump(args.metrics_file, args.metrics_interval)
+    if args.metrics_port is not None:
+        Metrics().start_http(args.metrics_port)
+    if args.trace_file is not None:
+        Tracer().open(args.trace_file)
+    # The KNX connection shared by all the lights, opened before the zones create them
+    LightGateway(rate_limit=args.knx_rate_limit)
+
+    # Opencv video capture of each camera, the frames are read on separate threads
+    camera_ids, controller = get_camera_ids()
+    captures = [FrameCapture(camera_id) for camera_id in camera_ids]
+
+    # Started tracker, the frames of all the cameras are sent to the same workers through shared memory
+    tracker = VideoTracker(concurrency=args.workers, batch_size=args.batch_size, max_wait=args.max_wait,
+                           imgsz=args.imgsz)
+    recorder = DetectionRecorder(args.record) if args.record is not None else None
+    pipeline = Pipeline(captures, tracker, args.report_interval, recorder)
+    # The tracker watches for motion only near the zones of each camera
+    Zone.listeners.append(tracker.set_zones)
+    # The zones of cameras not listed in camera_id.txt are skipped
+    Zone.cameras = set(pipeline.cameras)
+
+    if args.headless:
+        Zone.load_zones(path=args.zones)
+        run_headless(pipeline)
+    else:
+        # pygame is imported only if the interface is used
+        from gui import run_gui
+        run_gui(pipeline, controller, args.gui_fps, args.gui_camera)
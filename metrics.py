@@ -0,0 +1,166 @@
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""Metrics is a Singleton that keeps counters, gauges and latency histograms of the pipeline stages.
+Updating a value is a lock and a few operations, so the metrics stay on in production.
+They are exported as JSON by a periodic file dump or by a local HTTP endpoint"""
+
+
+class Histogram:
+    # Upper bounds in seconds of the buckets, from 50 microseconds to 30 seconds, each 25% wider
+    BOUNDS = tuple(0.00005 * 1.25 ** i for i in range(int(math.log(30 / 0.00005, 1.25)) + 2))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """upper bound of the bucket with the q percentile, at most 25% more than the real value"""
+        if self.count == 0:
+            return None
+        rank = q / 100 * self.count
+        cumulative = 0
+        for bound, count in zip(self.BOUNDS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count,
+                'mean_ms': self.total / self.count * 1000,
+                'p50_ms': self.percentile(50) * 1000,
+                'p95_ms': self.percentile(95) * 1000,
+                'p99_ms': self.percentile(99) * 1000,
+                'max_ms': self.max * 1000}
+
+
+class _Timer:
+    """context manager that observes the seconds spent in the block"""
+    __slots__ = ("_metrics", "_name", "_started")
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._name, time.perf_counter() - self._started)
+
+
+class Metrics:
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, 'instance'):
+            cls.instance = super().__new__(cls)
+        return cls.instance
+
+    def __init__(self):
+        if hasattr(self, "_lock"):
+            return
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._started = time.time()
+        self._server = None
+
+    def __reduce__(self):
+        # The lock can't be sent to the worker processes, each process has its own Metrics
+        return Metrics, ()
+
+    def count(self, name, value=1):
+        """adds value to the counter"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        """sets the actual value of the gauge, e.g. the depth of a queue"""
+        self._gauges[name] = value
+
+    def observe(self, name, seconds):
+        """adds a latency to the histogram"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name):
+        """with metrics.timer(name): the seconds spent in the block are added to the histogram"""
+        return _Timer(self, name)
+
+    def snapshot(self):
+        """all the values as a dictionary that can be written as JSON"""
+        with self._lock:
+            return {'time': time.time(),
+                    'uptime': time.time() - self._started,
+                    'counters': dict(self._counters),
+                    'gauges': dict(self._gauges),
+                    'latencies': {name: histogram.snapshot() for name, histogram in self._histograms.items()}}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def dump(self, path):
+        """writes the snapshot in the file, the file is replaced at once so it's never read half written"""
+        temporary = path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self.snapshot(), file, indent=1)
+        os.replace(temporary, path)
+
+    def start_file_dump(self, path, interval=10):
+        """writes the snapshot in the file every interval seconds"""
+        def dump_forever():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    print("Metrics dump Error:", e)
+        threading.Thread(target=dump_forever, daemon=True).start()
+
+    def start_http(self, port=9100, host="127.0.0.1"):
+        """serves the snapshot as JSON on http://host:port/metrics"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server.server_address[1]
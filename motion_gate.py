@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+"""MotionGate checks on a small copy of the frame if something is moving near the zones,
+the detection is needed only if there is motion"""
+
+
+class MotionGate:
+    def __init__(self, frame_shape, width=160, threshold=25, min_area=0.002, keep_alive=2.0,
+                 zone_padding=50, learning_rate=0.05):
+        """min_area is the fraction of the watched pixels that has to change,
+        keep_alive is how many seconds the gate stays open after the last motion"""
+        frame_height, frame_width = frame_shape[:2]
+        self._scale = width / frame_width
+        self._size = (width, max(1, round(frame_height * self._scale)))
+        self.threshold = threshold
+        self.min_area = min_area
+        self.keep_alive = keep_alive
+        self.zone_padding = zone_padding
+        self._learning_rate = learning_rate
+
+        self._background = None
+        # Pixels where the motion is checked, None is the whole frame
+        self._mask = None
+        self._watched_pixels = self._size[0] * self._size[1]
+        self._open_until = None
+
+    def set_zones(self, polygons):
+        """watches only the zones and a border around them, all the frame if there aren't zones"""
+        polygons = list(polygons)
+        if not polygons:
+            self._mask = None
+            self._watched_pixels = self._size[0] * self._size[1]
+            return
+        mask = np.zeros((self._size[1], self._size[0]), dtype=np.uint8)
+        for polygon in polygons:
+            padded = polygon.buffer(self.zone_padding, join_style="mitre")
+            points = np.asarray(padded.exterior.coords) * self._scale
+            cv2.fillPoly(mask, [points.round().astype(np.int32)], 255)
+        self._mask = mask
+        self._watched_pixels = max(1, cv2.countNonZero(mask))
+
+    def check(self, frame, timestamp):
+        """returns True if there was motion in the watched pixels in the last keep_alive seconds"""
+        small = cv2.resize(frame, self._size, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            self._open_until = timestamp + self.keep_alive
+            return True
+
+        # The background is a running average, slow movements are detected too
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        cv2.accumulateWeighted(gray, self._background, self._learning_rate)
+        _, moving = cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)
+        if self._mask is not None:
+            moving = cv2.bitwise_and(moving, self._mask)
+
+        if cv2.countNonZero(moving) >= self.min_area * self._watched_pixels:
+            self._open_until = timestamp + self.keep_alive
+        return timestamp <= self._open_until
@@ -0,0 +1,105 @@
+import numpy as np
+
+"""ObjectTracker keeps the identity of the people between the detections and predicts
+their position on the frames without detection"""
+
+
+class Track:
+    """a person followed across the frames, the box is x1, y1, x2, y2"""
+
+    def __init__(self, track_id, box, timestamp):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float64)
+        # Pixels per second of each coordinate of the box
+        self.velocity = np.zeros(4)
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+
+    def predict(self, timestamp):
+        """position of the box at timestamp if the person keeps the same velocity"""
+        return self.box + self.velocity * (timestamp - self.last_seen)
+
+    def update(self, box, timestamp, alpha, beta):
+        """corrects position and velocity with the detected box (alpha-beta filter)"""
+        dt = timestamp - self.last_seen
+        predicted = self.predict(timestamp)
+        residual = np.asarray(box, dtype=np.float64) - predicted
+        self.box = predicted + alpha * residual
+        if dt > 0:
+            self.velocity = self.velocity + beta * residual / dt
+        self.last_seen = timestamp
+        self.hits += 1
+
+    def dwell_time(self, timestamp):
+        """seconds since the person was detected the first time"""
+        return timestamp - self.first_seen
+
+    def center(self, timestamp):
+        x1, y1, x2, y2 = self.predict(timestamp)
+        return (x1 + x2) / 2, (y1 + y2) / 2
+
+
+class ObjectTracker:
+    def __init__(self, iou_threshold=0.3, max_age=1.5, min_hits=1, alpha=0.6, beta=0.2):
+        """a detection is assigned to a track if their boxes overlap at least iou_threshold,
+        a track is removed if it's not detected for max_age seconds"""
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.alpha = alpha
+        self.beta = beta
+        self.tracks = []
+        self._next_id = 1
+
+    @staticmethod
+    def iou(boxes_a, boxes_b):
+        """matrix (len(a), len(b)) with the intersection over union of each pair of boxes"""
+        a = boxes_a[:, None, :]
+        b = boxes_b[None, :, :]
+        width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+        height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+        intersection = width * height
+        area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+        area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+        union = area_a + area_b - intersection
+        return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+    def update(self, boxes, timestamp):
+        """assigns the boxes detected in the frame captured at timestamp to the tracks,
+        the boxes that don't match any track start a new one"""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        predicted = np.array([track.predict(timestamp) for track in self.tracks]).reshape(-1, 4)
+        iou = self.iou(predicted, boxes)
+
+        # Greedy assignment, the pairs with the highest overlap are matched first
+        matched_tracks, matched_boxes = set(), set()
+        for track_index, box_index in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+            if iou[track_index, box_index] < self.iou_threshold:
+                break
+            if track_index in matched_tracks or box_index in matched_boxes:
+                continue
+            self.tracks[track_index].update(boxes[box_index], timestamp, self.alpha, self.beta)
+            matched_tracks.add(track_index)
+            matched_boxes.add(box_index)
+
+        for box_index in range(len(boxes)):
+            if box_index not in matched_boxes:
+                self.tracks.append(Track(self._next_id, boxes[box_index], timestamp))
+                self._next_id += 1
+        self._remove_lost(timestamp)
+
+    def predict(self, timestamp):
+        """returns the confirmed tracks and their boxes predicted at timestamp"""
+        self._remove_lost(timestamp)
+        return [(track, track.predict(timestamp)) for track in self.tracks if track.hits >= self.min_hits]
+
+    def freeze(self, timestamp):
+        """keeps the tracks where they are, used when the scene is static and the detection is skipped"""
+        for track in self.tracks:
+            track.box = track.predict(timestamp)
+            track.velocity[:] = 0
+            track.last_seen = timestamp
+
+    def _remove_lost(self, timestamp):
+        self.tracks = [track for track in self.tracks if timestamp - track.last_seen <= self.max_age]
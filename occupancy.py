@@ -0,0 +1,44 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+"""OccupancyEngine counts the people in each zone testing all the centers against all the zones at once"""
+
+
+class OccupancyEngine:
+    def __init__(self, polygons=()):
+        self._polygons = []
+        self._tree = None
+        self.set_polygons(polygons)
+
+    def __len__(self):
+        return len(self._polygons)
+
+    def set_polygons(self, polygons):
+        """builds the spatial index, has to be called each time the zones change"""
+        self._polygons = list(polygons)
+        if self._polygons:
+            self._tree = STRtree(self._polygons)
+            # Prepared geometries make the repeated intersects tests cheaper
+            shapely.prepare(self._tree.geometries)
+        else:
+            self._tree = None
+
+    def count(self, points, borders):
+        """returns an array with the number of centers that collide with each polygon,
+        a center collides if the square created around it intersects the polygon"""
+        counts = np.zeros(len(self._polygons), dtype=np.int64)
+        if self._tree is None or points is None or len(points) == 0:
+            return counts
+
+        centers = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x, y = centers[:, 0], centers[:, 1]
+        if borders > 0:
+            colliders = shapely.box(x - borders, y - borders, x + borders, y + borders)
+        else:
+            colliders = shapely.points(centers)
+
+        # Each (center, polygon) pair appears once, so a person is counted once per zone
+        _, polygon_indices = self._tree.query(colliders, predicate="intersects")
+        counts += np.bincount(polygon_indices, minlength=len(self._polygons))
+        return counts
@@ -0,0 +1,188 @@
+"""Offline analysis of recorded footage, to size the zones on the places people really walk through.
+
+The video is split in chunks analyzed in parallel, each process opens the video and seeks to its chunk:
+    python offline_analysis.py video.mp4 --zones zones.json --workers 4 --output occupancy.npz --image heatmap.png
+
+The output has the occupancy heatmap, how many of the frames analyzed had a person on each cell of the frame,
+and the people counted in each zone of the zones file for each frame analyzed, as the live zones count them.
+"""
+import argparse
+import json
+import multiprocessing
+import time
+
+import cv2
+import numpy as np
+from shapely import Polygon
+
+from letterbox import Letterbox
+from occupancy import OccupancyEngine
+from ultralytics import YOLO
+from zone import Zone
+
+# Model and letterbox of the worker process, loaded once for all its chunks
+_model = None
+_letterbox = None
+
+
+def _load_model(imgsz):
+    global _model, _letterbox
+    _model = YOLO('yolov8n.pt')
+    _letterbox = Letterbox(imgsz)
+
+
+def video_info(path):
+    """returns frames, frames per second, width and height of the video"""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Can't open {path}")
+    info = (int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS) or 25.0,
+            int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    cap.release()
+    return info
+
+
+def detect(frames):
+    """returns the centers of the people found in each frame"""
+    squares = np.empty((len(frames), _letterbox.size, _letterbox.size, 3), dtype=np.uint8)
+    transforms = [_letterbox.apply(frame, square) for frame, square in zip(frames, squares)]
+    centers = []
+    for result, transform in zip(_model.predict(list(squares), imgsz=_letterbox.size, verbose=False), transforms):
+        data = result.boxes.data.cpu().numpy()
+        # class_id 0 is the person id, score is the accuracy of the prediction
+        boxes = Letterbox.unmap(data[(data[:, 5] == 0) & (data[:, 4] >= 0.5), :4], transform)
+        centers.append(np.column_stack(((boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2)))
+    return centers
+
+
+def analyze_chunk(job):
+    """detects the people in the frames start, start + stride, ... before stop.
+    Returns the chunk start, the frames analyzed, the people of each zone in each of them and the heatmap"""
+    path, start, stop, stride, zones, borders, cell, shape, batch_size = job
+    engine = OccupancyEngine(Polygon(points) for points in zones)
+    heatmap = np.zeros(shape, dtype=np.uint32)
+    # Cells covered by a person in the frame, each cell is counted once even if more people cover it
+    occupied = np.zeros(shape, dtype=bool)
+    indices, counts = [], []
+
+    def flush(batch, batch_indices):
+        for index, centers in zip(batch_indices, detect(batch)):
+            indices.append(index)
+            counts.append(engine.count(centers, borders))
+            # Each person covers the square that the zones test, in cells of the heatmap
+            squares = []
+            for x, y in centers:
+                x0, y0 = max(0, int((x - borders) // cell)), max(0, int((y - borders) // cell))
+                squares.append((slice(y0, int((y + borders) // cell) + 1), slice(x0, int((x + borders) // cell) + 1)))
+                occupied[squares[-1]] = True
+            if squares:
+                np.add(heatmap, occupied, out=heatmap, casting="unsafe")
+                for square in squares:
+                    occupied[square] = False
+
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    batch, batch_indices = [], []
+    for index in range(start, stop):
+        # The frames skipped are only grabbed, they aren't decoded
+        if (index - start) % stride:
+            if not cap.grab():
+                break
+            continue
+        ret, frame = cap.read()
+        if not ret:
+            break
+        batch.append(frame)
+        batch_indices.append(index)
+        if len(batch) == batch_size:
+            flush(batch, batch_indices)
+            batch, batch_indices = [], []
+    if batch:
+        flush(batch, batch_indices)
+    cap.release()
+    counts = np.array(counts, dtype=np.uint16).reshape(len(counts), len(zones))
+    return start, np.array(indices, dtype=np.int64), counts, heatmap
+
+
+def analyze(path, zones, workers=4, chunk_seconds=60, stride=1, borders=None, cell=4, imgsz=640, batch_size=4):
+    """analyzes the video with workers processes, zones are the points of each zone.
+    The chunks are merged in the order of the video"""
+    frames, fps, width, height = video_info(path)
+    if borders is None:
+        borders = Zone.collider_borders
+    chunk = max(stride, int(chunk_seconds * fps) // stride * stride)
+    shape = (height // cell + 1, width // cell + 1)
+    zones = [Zone.order_points_clockwise(points) for points in zones]
+    jobs = [(path, start, min(start + chunk, frames), stride, zones, borders, cell, shape, batch_size)
+            for start in range(0, frames, chunk)]
+
+    results = []
+    with multiprocessing.Pool(workers, initializer=_load_model, initargs=(imgsz,)) as pool:
+        for done, result in enumerate(pool.imap_unordered(analyze_chunk, jobs), 1):
+            results.append(result)
+            print(f"{done}/{len(jobs)} chunks analyzed")
+    results.sort(key=lambda result: result[0])
+
+    indices = np.concatenate([result[1] for result in results]) if results else np.zeros(0, np.int64)
+    counts = np.concatenate([result[2] for result in results]) if results else np.zeros((0, len(zones)), np.uint16)
+    heatmap = np.sum([result[3] for result in results], axis=0, dtype=np.uint64) if results else np.zeros(shape)
+    return {'fps': fps, 'frames': frames, 'cell': cell, 'borders': borders,
+            'frame_index': indices, 'time': indices / fps, 'counts': counts,
+            'heatmap': heatmap / max(len(indices), 1), 'zones': zones}
+
+
+def heatmap_image(path, heatmap, cell):
+    """the first frame of the video with the heatmap over it"""
+    cap = cv2.VideoCapture(path)
+    ret, frame = cap.read()
+    cap.release()
+    colors = cv2.applyColorMap((heatmap / max(heatmap.max(), 1e-9) * 255).astype(np.uint8), cv2.COLORMAP_JET)
+    colors = cv2.resize(colors, (heatmap.shape[1] * cell, heatmap.shape[0] * cell),
+                        interpolation=cv2.INTER_NEAREST)[:frame.shape[0], :frame.shape[1]]
+    return cv2.addWeighted(frame, 0.5, colors, 0.5, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video")
+    parser.add_argument("--zones", default=None, help="zones file, the people of its zones are counted")
+    parser.add_argument("--camera", type=int, default=0, help="camera of the video, only its zones are counted")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--chunk-seconds", type=float, default=60, help="seconds of video analyzed by each job")
+    parser.add_argument("--stride", type=int, default=1, help="one frame analyzed each stride frames")
+    parser.add_argument("--collider-borders", type=float, default=None,
+                        help="half side of the square around each person, the one of Zone if not given")
+    parser.add_argument("--cell", type=int, default=4, help="pixels of each side of the heatmap cells")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--output", default="occupancy.npz")
+    parser.add_argument("--image", default=None, help="image file where the heatmap is drawn over the video")
+    args = parser.parse_args()
+
+    zones = []
+    if args.zones is not None:
+        zones = [record['points'] for record in Zone.read_zones_file(args.zones)
+                 if record.get('camera', 0) == args.camera]
+
+    started = time.perf_counter()
+    result = analyze(args.video, zones, args.workers, args.chunk_seconds, args.stride, args.collider_borders,
+                     args.cell, args.imgsz, args.batch_size)
+    elapsed = time.perf_counter() - started
+
+    with open(args.output, "wb") as file:
+        np.savez_compressed(file, fps=result['fps'], cell=result['cell'], borders=result['borders'],
+                            frame_index=result['frame_index'], time=result['time'], counts=result['counts'],
+                            heatmap=result['heatmap'].astype(np.float32), zones=json.dumps(result['zones']))
+    if args.image is not None:
+        cv2.imwrite(args.image, heatmap_image(args.video, result['heatmap'], args.cell))
+
+    duration = result['frames'] / result['fps']
+    occupied = (result['counts'] > 0).mean(axis=0) if len(result['counts']) else np.zeros(len(zones))
+    print(json.dumps({'frames': result['frames'], 'frames_analyzed': len(result['frame_index']),
+                      'duration': round(duration, 1), 'elapsed': round(elapsed, 1),
+                      'speed': round(duration / elapsed, 1),
+                      'zones_occupied': [round(float(value), 4) for value in occupied]}))
+
+
+if __name__ == '__main__':
+    main()
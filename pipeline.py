@@ -0,0 +1,79 @@
+import time
+
+from tracing import Tracer
+from zone import Zone
+
+"""Pipeline reads the frames of all the cameras in turn and sends them to the shared tracker,
+the people found by each camera update only the zones of that camera"""
+
+
+class Pipeline:
+    def __init__(self, captures, tracker, report_interval=30, recorder=None):
+        """captures are the FrameCapture of the cameras, each one is added to the tracker.
+        The throughput of each camera is printed every report_interval seconds, never if it's None.
+        If there is a DetectionRecorder the people detected in each frame are recorded for the replay"""
+        self.captures = list(captures)
+        self.tracker = tracker
+        self.cameras = [tracker.add_camera((int(cap.height), int(cap.width), 3)) for cap in self.captures]
+        # Last frame read from each camera, used by the interface
+        self.frames = [None] * len(self.captures)
+        self.frames_read = [0] * len(self.captures)
+        self.report_interval = report_interval
+        self._reported_frames = [0] * len(self.captures)
+        self._last_report = time.monotonic()
+        self._next = 0
+        self._tracer = Tracer()
+        self.recorder = recorder
+
+    def step(self):
+        """processes the next camera with a new frame, the cameras are checked in turn so a fast camera
+        doesn't starve the others. Returns the index of the camera processed, None if there weren't new frames"""
+        processed = None
+        for offset in range(len(self.captures)):
+            index = (self._next + offset) % len(self.captures)
+            capture = self.captures[index]
+            ret, frame = capture.read(timeout=0)
+            if not ret:
+                continue
+            self._next = (index + 1) % len(self.captures)
+            self.frames[index] = frame
+            self.frames_read[index] += 1
+            if self.tracker.is_started():
+                camera = self.cameras[index]
+                # The trace follows the frame until the telegrams it causes, if tracing is on
+                trace = self._tracer.start(camera, capture.last_frame_time)
+                centers = self.tracker.object_detection(frame, capture.last_frame_time, camera, trace)
+                if self.recorder is not None:
+                    self.recorder.record(camera, capture.last_frame_time, centers)
+                Zone.update_zone(centers, camera, trace)
+            processed = index
+            break
+
+        if self.report_interval is not None and time.monotonic() - self._last_report >= self.report_interval:
+            self.report()
+        if processed is None:
+            # No camera has a new frame, waits a little instead of spinning
+            time.sleep(0.002)
+        return processed
+
+    def report(self):
+        """prints frames read and detected per second of each camera since the last report"""
+        now = time.monotonic()
+        elapsed = max(now - self._last_report, 1e-9)
+        for index, capture in enumerate(self.captures):
+            stats = self.tracker.inference_stats(self.cameras[index])
+            read = self.frames_read[index] - self._reported_frames[index]
+            self._reported_frames[index] = self.frames_read[index]
+            print(f"Camera {self.cameras[index]}: {read / elapsed:.1f} fps read, "
+                  f"{stats.get('fps', 0.0):.1f} fps detected, "
+                  f"{capture.stats()['dropped']} frames dropped by the capture, "
+                  f"{stats['frames_skipped']} skipped, {stats['frames_gated']} gated, "
+                  f"{stats['results_dropped']} results dropped")
+        self._last_report = now
+
+    def release(self):
+        for capture in self.captures:
+            capture.release()
+        if self.recorder is not None:
+            self.recorder.close()
+            print(f"{len(self.recorder)} frames recorded in {self.recorder.path}")
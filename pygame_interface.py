@@ -1,5 +1,6 @@
 import random
 
+import numpy as np
 import pygame
 import lights_control
 
@@ -19,6 +20,8 @@ class PygameInterface:
         self.height = height
         self._screen = pygame.display.set_mode((width, height))
         self._zones = []
+        # Number of the last zone added, the names don't repeat when a zone is removed
+        self._zone_number = 0
         self._boxes = []
         self._boxes_centers = []
         self._points = []
@@ -45,6 +48,15 @@ class PygameInterface:
         self.dead_zone = self.create_dead_zone()
         self.zones_recap = self.create_zones_recap()
 
+        # The static elements are drawn on cached layers, redrawn only when they change.
+        # The color key is a color the zones never have, those pixels are transparent
+        self._layer_color_key = (0, 255, 0)
+        self._zones_layer = self._create_layer()
+        self._panels_layer = self._create_layer()
+        self._layers_changed = True
+        # Surface where the frames of another size are scaled, built in the format of the first one
+        self._scaled_frame = None
+
         pygame.display.set_caption(name)
 
     class Button:
@@ -69,38 +81,81 @@ class PygameInterface:
 
         def __init__(self, name, font, polygon, light, pos_x, pos_y, width, height):
             self.polygon = polygon
+            # The points are read from the polygon only once
+            self.points = list(polygon.exterior.coords)
             self._light = light
             self._font = font
             self.name = name
             # creates a random color for the text and the zone polygon
             self.color = (random.randint(0, 255), random.randint(0, 199), random.randint(0, 255))
-            self.text_render = self._font.render(f"{self.name} {self._light.address} {self._light.state}", True,
-                                                 self.color)
+            # Text rendered for each light state, the text changes only with the state
+            self._text_renders = {}
+            self._rendered_state = self._light.state
+            self.text_render = self._render_text(self._rendered_state)
             self.recap = PygameInterface.Button(pos_x, pos_y, width, height, self.text_render)
 
+        def _render_text(self, state):
+            if state not in self._text_renders:
+                self._text_renders[state] = self._font.render(f"{self.name} {self._light.address} {state}", True,
+                                                              self.color)
+            return self._text_renders[state]
+
         def update(self):
-            """check and change the status of the light each time the zone is drawn"""
-            self.text_render = self._font.render(f"{self.name} {self._light.address} {self._light.state}", True,
-                                                 self.color)
-            self.recap.rendered_text_default = self.text_render
-
-    def adjust_frame(self, frame_rgb):
-        """set the frame on pygame display and draws all the elements of the interface"""
-        pygame_frame = pygame.surfarray.make_surface(frame_rgb)
-        rotated_pygame_frame = pygame.transform.rotate(pygame_frame, -90)
-        rotated_pygame_frame = pygame.transform.scale(rotated_pygame_frame, (self.width, self.height))
-        # self.screen.blit(rotated_pygame_frame, (0, 0))
-        mirrored_image = pygame.transform.flip(rotated_pygame_frame, True, False)
-        self._screen.blit(mirrored_image, (0, 0))
+            """check and change the status of the light each time the zone is drawn,
+            the text is changed only if the state of the light changed"""
+            state = self._light.state
+            if state != self._rendered_state:
+                self._rendered_state = state
+                self.text_render = self._render_text(state)
+                self.recap.rendered_text_default = self.text_render
+
+    def adjust_frame(self, frame):
+        """set the BGR frame on pygame display and draws all the elements of the interface"""
+        frame = np.ascontiguousarray(frame)
+        frame_size = frame.shape[1], frame.shape[0]
+        # The surface reads the memory of the frame, the BGR colors are converted during the blit
+        frame_surface = pygame.image.frombuffer(frame, frame_size, "BGR")
+        if frame_size == self._screen.get_size():
+            self._screen.blit(frame_surface, (0, 0))
+        else:
+            # The destination of transform.scale must have the format of the frame surface
+            if self._scaled_frame is None:
+                self._scaled_frame = pygame.Surface(self._screen.get_size(), 0, frame_surface)
+            pygame.transform.scale(frame_surface, self._screen.get_size(), self._scaled_frame)
+            self._screen.blit(self._scaled_frame, (0, 0))
+
+        if self._layers_changed:
+            self.draw_layers()
 
         # Updates pygame display, the order represents layering
+        self._screen.blit(self._zones_layer, (0, 0))
         self.draw_points()
-        self.draw_zones()
         self.draw_boxes()
+        self._screen.blit(self._panels_layer, (0, 0))
         self.draw_zone_recap()
+        pygame.display.flip()
+
+    def _create_layer(self):
+        layer = pygame.Surface((self.width, self.height))
+        layer.set_colorkey(self._layer_color_key, pygame.RLEACCEL)
+        return layer
+
+    def draw_layers(self):
+        """draws the zones, the dead zone, the zone recap and the buttons on the cached layers"""
+        # The draw methods draw on self._screen, it points to the layer while it's drawn
+        self._zones_layer.fill(self._layer_color_key)
+        screen, self._screen = self._screen, self._zones_layer
+        self.draw_zones()
+
+        self._panels_layer.fill(self._layer_color_key)
+        self._screen = self._panels_layer
+        pygame.draw.rect(self._screen, (200, 200, 200), self.zones_recap)
+        for zone in self._zones:
+            pygame.draw.rect(self._screen, (255, 255, 255), zone.recap.rect)
         self.draw_dead_zone()
         self.draw_buttons(self.buttons.values())
-        pygame.display.flip()
+        self._screen = screen
+        self._layers_changed = False
 
     def create_buttons(self):
         """creates the buttons for the interface"""
@@ -161,34 +216,47 @@ class PygameInterface:
 
     def add_zone(self, zone_polygon, zone_light: lights_control.Light):
         """add a zone on the interface and set data for the recap"""
-        zone_name = "Zone " + str((len(self._zones) + 1))
+        self._zone_number += 1
+        zone_name = "Zone " + str(self._zone_number)
         recap_width = self.partition_width
         recap_height = self.object_height / 1.5
-        margin = self.margin_top / 2
 
         pos_x = self.margin_right
-        pos_y = len(self._zones) * (recap_height + margin)
+        pos_y = self._recap_y(len(self._zones))
         zone = self.Zone(zone_name, self._font, zone_polygon, zone_light, pos_x, pos_y, recap_width, recap_height)
         self._zones.append(zone)
         self._points = []
+        self._layers_changed = True
+
+    def _recap_y(self, index):
+        """vertical position of the recap of the zone in position index"""
+        return index * (self.object_height / 1.5 + self.margin_top / 2)
+
+    def remove_zone(self, zone_polygon):
+        """removes the zone from the interface, the recaps of the zones after it move up"""
+        self._zones = [zone for zone in self._zones if zone.polygon is not zone_polygon]
+        for index, zone in enumerate(self._zones):
+            zone.recap.rect.y = self._recap_y(index)
+        self._layers_changed = True
 
     def delete_zones(self):
         """removes all the zones on the interface"""
         self._zones.clear()
+        self._zone_number = 0
+        self._layers_changed = True
 
     def draw_zones(self):
         """draws the zones on the interface"""
         # Cycles all thr points and connects them with a line
         for zone in self._zones:
-            points = list(zone.polygon.exterior.coords)
-            self.draw_empty_rectangle(points, zone.color, 4)
-            zone.update()
+            self.draw_empty_rectangle(zone.points, zone.color, 4)
 
     def update_text(self, button):
         """updates the text of the button clicked"""
         if button in self.buttons:
             changed_button = self.buttons[button]
             changed_button.swap_texts()
+            self._layers_changed = True
         else:
             print("Button name not correct")
 
@@ -208,13 +276,8 @@ class PygameInterface:
         self._boxes_centers = []
 
     def draw_empty_rectangle(self, points, color, width):
-        """draws a polygon using the points"""
-        current_point = first_point = points[0]
-        points.remove(first_point)
-        for point in points:
-            pygame.draw.line(self._screen, color, current_point, point, width)
-            current_point = point
-        pygame.draw.line(self._screen, color, current_point, first_point, width)
+        """draws a polygon using the points, the list of points is not changed"""
+        pygame.draw.lines(self._screen, color, True, points, width)
 
     def create_dead_zone(self):
         """creates a partition of the interface where isn't possible create a zone"""
@@ -231,12 +294,11 @@ class PygameInterface:
         return zones_recap
 
     def draw_zone_recap(self):
-        """draws the zone recap on the interface and all the zone objects on the recap"""
-        pygame.draw.rect(self._screen, (200, 200, 200), self.zones_recap)
-        button_to_draw = []
+        """draws the text of the zone objects on the recap, the background is on the cached layer"""
         for zone in self._zones:
-            button_to_draw.append(zone.recap)
-        self.draw_buttons(button_to_draw)
+            zone.update()
+            self._screen.blit(zone.recap.rendered_text_default,
+                              (zone.recap.rect.x + self.margin_left, zone.recap.rect.y + self.margin_top * 1.5))
 
     def add_point(self, position):
         self._points.append(position)
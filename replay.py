@@ -0,0 +1,268 @@
+"""Record the people detected by the tracker and replay them offline, faster than real time.
+
+The recording keeps the centers of the people of each frame, written with --record by main.py:
+    python main.py --headless --record detections.rec
+
+The replay sends the recorded centers to the zones and the lights of a zones file on a simulated clock,
+the hold times and the telegrams to the bus are simulated too, so an hour of recording takes seconds.
+The telegrams the lights would have sent are written one JSON line each, to compare configurations:
+    python replay.py detections.rec --zones zones.json --collider-borders 30 --hold-time 5 --output telegrams.jsonl
+"""
+import argparse
+import collections
+import functools
+import heapq
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from lights_control import Light, LightGateway, LightScheduler
+from zone import Zone
+
+
+class DetectionRecorder:
+    """writes the centers detected in each frame in columns: the capture time, the camera and the number
+    of people of each frame, and the centers of all the frames one after the other.
+    The frames are appended to the file in chunks while they are recorded, so a recording stopped by a crash
+    loses at most the last chunk and the memory used doesn't grow with the recording"""
+    # Frames kept in memory before they are written, and the most seconds they are kept
+    CHUNK = 1000
+    FLUSH_INTERVAL = 10
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = 0
+        self._times, self._cameras, self._counts, self._centers = [], [], [], []
+        self._file = open(path, "wb")
+        self._flushed = time.monotonic()
+
+    def __len__(self):
+        return self.frames
+
+    def record(self, camera, frame_time, centers):
+        self._times.append(frame_time)
+        self._cameras.append(camera)
+        self._counts.append(len(centers))
+        self._centers.extend(centers)
+        self.frames += 1
+        if len(self._times) >= self.CHUNK or time.monotonic() - self._flushed >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """appends the frames not written yet to the file, each column as a NumPy array"""
+        self._flushed = time.monotonic()
+        if not self._times or self._file is None:
+            return
+        for column in (np.array(self._times, dtype=np.float64),
+                       np.array(self._cameras, dtype=np.uint16),
+                       np.array(self._counts, dtype=np.uint16),
+                       np.array(self._centers, dtype=np.float32).reshape(-1, 2)):
+            np.save(self._file, column)
+        self._file.flush()
+        self._times, self._cameras, self._counts, self._centers = [], [], [], []
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def load_recording(path):
+    """returns the time, camera and centers of each frame recorded in the file"""
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        while file.tell() < size:
+            try:
+                times, cameras, counts, centers = [np.load(file) for _ in range(4)]
+            except (ValueError, EOFError, OSError):
+                # The last chunk was written only in part, the recording was stopped by a crash
+                print(f"{path}: the last chunk is incomplete, it's skipped")
+                return
+            offsets = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+            centers = centers.astype(np.float64)
+            for index in range(len(times)):
+                yield float(times[index]), int(cameras[index]), centers[offsets[index]:offsets[index + 1]]
+
+
+class SimulatedClock:
+    """the time of the replay, the timers are called in order when the clock is advanced past them"""
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self._timers = []
+        self._sequence = itertools.count()
+
+    def call_at(self, when, callback):
+        """returns the timer, a list whose first item is set to None to cancel it"""
+        timer = [callback]
+        heapq.heappush(self._timers, (when, next(self._sequence), timer))
+        return timer
+
+    def advance(self, until=None):
+        """calls the timers due until the time, or all of them if it's None"""
+        while self._timers and (until is None or self._timers[0][0] <= until):
+            when, _, timer = heapq.heappop(self._timers)
+            self.now = max(self.now, when)
+            if timer[0] is not None:
+                timer[0]()
+        if until is not None:
+            self.now = max(self.now, until)
+
+
+class SimulatedScheduler:
+    """LightScheduler on the simulated clock"""
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._timers = {}
+
+    def __len__(self):
+        return len(self._timers)
+
+    def schedule(self, key, delay, callback):
+        self.cancel(key)
+        self._timers[key] = self._clock.call_at(self._clock.now + delay, lambda: self._expire(key, callback))
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer[0] = None
+
+    def _expire(self, key, callback):
+        self._timers.pop(key, None)
+        callback()
+
+
+class SimulatedGateway:
+    """LightGateway on the simulated clock: the bus starts with all the lights off, the telegrams are sent
+    at most rate_limit per second, the switch ons first, only the last switch of each light waiting is sent
+    and the switches to the state the light already has are not sent"""
+
+    def __init__(self, clock, rate_limit=20):
+        self._clock = clock
+        self.rate_limit = rate_limit
+        self.states = {}
+        # (time, group address, value) of each telegram sent
+        self.telegrams = []
+        self.suppressed = 0
+        self.coalesced = 0
+        self._telegrams = {True: collections.OrderedDict(), False: collections.OrderedDict()}
+        self._bus_free = clock.now
+        self._sending = False
+
+    @property
+    def loop(self):
+        return None
+
+    def register(self, lights):
+        for light in lights:
+            self.states.setdefault(light.address, False)
+
+    def unregister(self, lights):
+        for light in lights:
+            self.states.pop(light.address, None)
+
+    def send(self, light, new_state, trace=None):
+        # Queued after the caller returns, as the live gateway does on its event loop: the caller holds
+        # the lock of the light, and sent of a replaced telegram takes it
+        self._clock.call_at(self._clock.now, functools.partial(self._put, light, new_state))
+
+    def _put(self, light, new_state):
+        for telegrams in self._telegrams.values():
+            if telegrams.pop(light.address, None) is not None:
+                self.coalesced += 1
+                light.sent(None)
+        self._telegrams[bool(new_state)][light.address] = light
+        if not self._sending:
+            self._sending = True
+            self._clock.call_at(max(self._clock.now, self._bus_free), self._send_next)
+
+    def send_many(self, telegrams):
+        for light, new_state in telegrams:
+            self.send(light, new_state)
+
+    def _send_next(self):
+        while True:
+            for new_state in (True, False):
+                if self._telegrams[new_state]:
+                    break
+            else:
+                self._sending = False
+                return
+            _, light = self._telegrams[new_state].popitem(last=False)
+            if self.states.get(light.address) == new_state:
+                self.suppressed += 1
+                light.sent(new_state)
+                continue
+            self.telegrams.append((self._clock.now, light.address, int(new_state)))
+            self.states[light.address] = new_state
+            light.sent(new_state)
+            if self.rate_limit:
+                # The next telegram waits until the bus can carry it
+                self._bus_free = self._clock.now + 1 / self.rate_limit
+                self._clock.call_at(self._bus_free, self._send_next)
+                return
+
+
+def replay(recording, zones_path, collider_borders=None, hold_time=None, rate_limit=20):
+    """sends the recorded centers to the zones of the file, returns the simulated gateway with the
+    telegrams sent, their times are seconds from the first frame"""
+    frames = list(load_recording(recording))
+    clock = SimulatedClock(frames[0][0] if frames else 0.0)
+    gateway = SimulatedGateway(clock, rate_limit)
+    # The lights get the simulated gateway and scheduler instead of the Singletons connected to the bus
+    LightGateway.instance = gateway
+    LightScheduler.instance = SimulatedScheduler(clock)
+    if collider_borders is not None:
+        Zone.collider_borders = collider_borders
+    Zone.load_zones(path=zones_path)
+    if hold_time is not None:
+        for light in Light.lights:
+            light.hold_time = hold_time
+
+    # The lights are switched off at the start, the replay starts with the first frame
+    clock.advance(clock.now)
+    start = clock.now
+    gateway.telegrams.clear()
+    for frame_time, camera, centers in frames:
+        clock.advance(frame_time)
+        Zone.update_zone(centers, camera)
+    # The lights still on are switched off after their hold time
+    clock.advance()
+    gateway.telegrams = [(round(t - start, 3), address, value) for t, address, value in gateway.telegrams]
+    return gateway, len(frames), (frames[-1][0] - start if frames else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording")
+    parser.add_argument("--zones", default="zones.json", help="zones file whose lights are simulated")
+    parser.add_argument("--collider-borders", type=float, default=None,
+                        help="half side of the square around each person, the one of Zone if not given")
+    parser.add_argument("--hold-time", type=float, default=None,
+                        help="seconds the lights stay on, the ones of the zones file if not given")
+    parser.add_argument("--rate-limit", type=int, default=20, help="telegrams per second of the bus, 0 is no limit")
+    parser.add_argument("--output", default=None, help="file where the telegrams are written, one JSON line each")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    gateway, frames, duration = replay(args.recording, args.zones, args.collider_borders, args.hold_time,
+                                       args.rate_limit)
+    elapsed = time.perf_counter() - started
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            for t, address, value in gateway.telegrams:
+                file.write(json.dumps({'time': t, 'address': address, 'on': value}) + "\n")
+    on = sum(value for _, _, value in gateway.telegrams)
+    print(json.dumps({'frames': frames, 'duration': round(duration, 3),
+                      'speed': round(duration / elapsed, 1) if elapsed else None,
+                      'telegrams': len(gateway.telegrams), 'on': on, 'off': len(gateway.telegrams) - on,
+                      'suppressed': gateway.suppressed, 'coalesced': gateway.coalesced}))
+
+
+if __name__ == '__main__':
+    main()
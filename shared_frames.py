@@ -0,0 +1,103 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+"""SharedFrameSlots is a pool of frames and detection results preallocated in shared memory,
+the processes exchange only the index of the slot"""
+
+
+class SharedFrameSlots:
+    # Maximum number of boxes written for each frame
+    MAX_DETECTIONS = 100
+    # Each box is x1, y1, x2, y2, score
+    BOX_FIELDS = 5
+
+    def __init__(self, slots, frame_shape):
+        self.slots = slots
+        self.frame_shape = tuple(frame_shape)
+        self._owner_pid = os.getpid()
+
+        frames_size = slots * int(np.prod(self.frame_shape))
+        # Boxes, start and end of the inference, number of boxes and height and width of the frame of each slot
+        results_size = slots * (self.MAX_DETECTIONS * self.BOX_FIELDS * 4 + 16 + 4 + 8)
+        self._frames_memory = shared_memory.SharedMemory(create=True, size=frames_size)
+        self._results_memory = shared_memory.SharedMemory(create=True, size=results_size)
+        self._create_views()
+
+    def _create_views(self):
+        """numpy arrays that use the shared memory as buffer, no copy is made"""
+        self.frames = np.ndarray((self.slots, *self.frame_shape), dtype=np.uint8,
+                                 buffer=self._frames_memory.buf)
+        self.results = np.ndarray((self.slots, self.MAX_DETECTIONS, self.BOX_FIELDS), dtype=np.float32,
+                                  buffer=self._results_memory.buf)
+        self.timings = np.ndarray((self.slots, 2), dtype=np.float64, buffer=self._results_memory.buf,
+                                  offset=self.results.nbytes)
+        self.counts = np.ndarray((self.slots,), dtype=np.int32, buffer=self._results_memory.buf,
+                                 offset=self.results.nbytes + self.timings.nbytes)
+        self.sizes = np.ndarray((self.slots, 2), dtype=np.int32, buffer=self._results_memory.buf,
+                                offset=self.results.nbytes + self.timings.nbytes + self.counts.nbytes)
+
+    def __getstate__(self):
+        # Only the names of the shared memory are sent to the worker processes
+        return {'slots': self.slots,
+                'frame_shape': self.frame_shape,
+                'owner_pid': self._owner_pid,
+                'frames_name': self._frames_memory.name,
+                'results_name': self._results_memory.name}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self.frame_shape = state['frame_shape']
+        self._owner_pid = state['owner_pid']
+        self._frames_memory = shared_memory.SharedMemory(name=state['frames_name'])
+        self._results_memory = shared_memory.SharedMemory(name=state['results_name'])
+        self._create_views()
+
+    def write_frame(self, slot, frame, letterbox=None):
+        """copies the frame in the slot, it's the only copy of the frame.
+        The frame can be smaller than the slot, for example a crop of the camera frame.
+        With a letterbox the frame is resized to fill the slot and the transform is returned"""
+        if letterbox is not None:
+            transform = letterbox.apply(frame, self.frames[slot])
+            self.sizes[slot] = self.frame_shape[:2]
+            return transform
+        height, width = frame.shape[:2]
+        np.copyto(self.frames[slot, :height, :width], frame)
+        self.sizes[slot] = height, width
+        return None
+
+    def read_frame(self, slot):
+        """returns the frame written in the slot, it's a view on the shared memory"""
+        height, width = self.sizes[slot]
+        return self.frames[slot, :height, :width]
+
+    def write_results(self, slot, boxes):
+        """writes the boxes (n, 5) detected in the frame of the slot"""
+        count = min(len(boxes), self.MAX_DETECTIONS)
+        if count:
+            self.results[slot, :count] = boxes[:count]
+        self.counts[slot] = count
+
+    def write_timing(self, slot, started, finished):
+        """writes when the inference of the slot started and finished, time.perf_counter() is the same
+        clock in all the processes"""
+        self.timings[slot] = started, finished
+
+    def read_timing(self, slot):
+        """returns (started, finished) of the inference of the slot"""
+        started, finished = self.timings[slot].tolist()
+        return started, finished
+
+    def read_results(self, slot):
+        """returns a copy of the boxes detected in the frame of the slot"""
+        return self.results[slot, :self.counts[slot]].copy()
+
+    def close(self):
+        """releases the shared memory, it's destroyed only by the process that created it"""
+        self.frames = self.results = self.timings = self.counts = self.sizes = None
+        self._frames_memory.close()
+        self._results_memory.close()
+        if os.getpid() == self._owner_pid:
+            self._frames_memory.unlink()
+            self._results_memory.unlink()
@@ -0,0 +1,148 @@
+"""Tracing follows each frame from the capture to the KNX telegram it causes.
+
+Each frame read gets a Trace, the stages add their spans to it and the trace is written in the
+trace log when the telegram is sent, one compact JSON line for each telegram:
+    {"id": 12, "camera": 0, "address": "0/0/1", "on": 1, "origin": 1712345678.123, "total": 183.2,
+     "spans": [["capture", 0.0, 1.2], ["inference", 3.5, 48.0], ...]}
+origin is the capture time of the frame the people were detected in, the spans are
+[name, start, duration] in milliseconds from the origin.
+
+The summary of a trace log, with p50/p95/p99 of the person to light latency and of each span:
+    python tracing.py trace.jsonl
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class Trace:
+    __slots__ = ("trace_id", "camera", "captured", "spans", "source")
+
+    def __init__(self, trace_id, camera, captured):
+        self.trace_id = trace_id
+        self.camera = camera
+        # time.time() when the frame was captured
+        self.captured = captured
+        # (name, start, end) with time.time() values
+        self.spans = []
+        # Trace of the older frame whose detection was used for this frame, if there is one
+        self.source = None
+
+    def add(self, name, start, end):
+        self.spans.append((name, start, end))
+
+    def branch(self):
+        """copy of the trace for one of the lights switched by the frame, its spans don't go in the others"""
+        trace = Trace(self.trace_id, self.camera, self.captured)
+        trace.spans = list(self.spans)
+        trace.source = self.source
+        return trace
+
+    @property
+    def origin(self):
+        """capture time of the frame the people were detected in"""
+        return self.source.captured if self.source is not None else self.captured
+
+    def record(self, **fields):
+        """the trace as a dictionary with the times in milliseconds from the origin"""
+        origin = self.origin
+        spans = self.source.spans + self.spans if self.source is not None else self.spans
+        spans = sorted(spans, key=lambda span: span[1])
+        record = {'id': self.trace_id, 'camera': self.camera, **fields, 'origin': round(origin, 4),
+                  'spans': [[name, round((start - origin) * 1000, 2), round((end - start) * 1000, 2)]
+                            for name, start, end in spans]}
+        if spans:
+            record['total'] = round((max(end for _, _, end in spans) - origin) * 1000, 2)
+        return record
+
+
+class Tracer:
+    """Tracer is a Singleton that creates the traces and writes them in the trace log.
+    If the trace log isn't opened no trace is created and the stages skip the tracing"""
+
+    def __new__(cls, *args, **kwargs):
+        if not hasattr(cls, 'instance'):
+            cls.instance = super().__new__(cls)
+        return cls.instance
+
+    def __init__(self):
+        if hasattr(self, "_lock"):
+            return
+        self._lock = threading.Lock()
+        self._file = None
+        self._ids = itertools.count(1)
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    def open(self, path):
+        """starts tracing, the traces are appended to the file"""
+        self._file = open(path, "a", buffering=1)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def start(self, camera, captured):
+        """returns the trace of a frame captured at the time captured, None if tracing is off"""
+        if self._file is None:
+            return None
+        trace = Trace(next(self._ids), camera, captured)
+        trace.add("capture", captured, time.time())
+        return trace
+
+    def write(self, trace, **fields):
+        """writes the trace with the fields of the event, e.g. the address of the light switched"""
+        line = json.dumps(trace.record(**fields), separators=(",", ":"))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+
+
+def summary(path):
+    """p50/p95/p99 of the person to light latency and of the spans of the lights switched on"""
+    totals, spans = [], {}
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            if not record.get('on') or 'total' not in record:
+                continue
+            totals.append(record['total'])
+            for name, _, duration in record['spans']:
+                spans.setdefault(name, []).append(duration)
+
+    def percentiles(values):
+        values = np.array(values)
+        return {'count': len(values),
+                'p50': float(np.percentile(values, 50)),
+                'p95': float(np.percentile(values, 95)),
+                'p99': float(np.percentile(values, 99))}
+
+    return {'person_to_light_ms': percentiles(totals) if totals else None,
+            'spans_ms': {name: percentiles(values) for name, values in spans.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace_log")
+    args = parser.parse_args()
+
+    result = summary(args.trace_log)
+    if result['person_to_light_ms'] is None:
+        print("No light switched on in the trace log")
+        return
+    print("{:<16}{:>8}{:>10}{:>10}{:>10}".format("", "count", "p50 ms", "p95 ms", "p99 ms"))
+    for name, stats in [('person to light', result['person_to_light_ms']), *result['spans_ms'].items()]:
+        print("{:<16}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}".format(name, stats['count'], stats['p50'],
+                                                             stats['p95'], stats['p99']))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,173 @@
+import atexit
 import multiprocessing
+import queue
+import time
+from collections import deque
 from multiprocessing import JoinableQueue
 
-from pygame_interface import PygameInterface
+import numpy as np
+
+from letterbox import Letterbox
+from metrics import Metrics
+from motion_gate import MotionGate
+from object_tracker import ObjectTracker
+from shared_frames import SharedFrameSlots
 from ultralytics import YOLO
 
-"""VideoTracker is a Singleton that manages the object detection"""
+"""VideoTracker is a Singleton that manages the object detection of all the cameras"""
+
+
+class CameraStream:
+    """state of the detection of one camera, the workers are shared by all the cameras"""
+
+    def __init__(self, frame_shape, detection_interval, motion_gating, keep_alive, roi_padding):
+        self.detection_interval = detection_interval
+        self.frame_passed = 0
+        self.object_tracker = ObjectTracker()
+        self.motion_gating = motion_gating
+        self.keep_alive = keep_alive
+        # Boxes (x, y, w, h) of the people in the last frame, read by the interface if there is one
+        self.boxes = []
+
+        # Region of the frame (x1, y1, x2, y2) sent to the model, all the frame if there aren't zones
+        self.roi_padding = roi_padding
+        self.region = None
+        self._polygons = []
+        # The motion gate and the region are sized on the frames, the shape given is used only if it's valid
+        self.frame_shape = None
+        self.motion_gate = None
+        if frame_shape is not None and min(frame_shape[:2]) > 0:
+            self.set_frame_shape(frame_shape)
+
+        # Sequence number of the last frame sent and of the last result returned
+        self.sequence = 0
+        self.last_sequence = 0
+        # Newest result not returned yet and frames sent to the workers without result
+        self.newest = None
+        self.in_flight = 0
+        # Traces of the newest result and of the last result returned, if tracing is on
+        self.newest_trace = None
+        self.result_trace = None
+
+        self.frames_skipped = 0
+        self.frames_gated = 0
+        self.frames_completed = 0
+        self.results_dropped = 0
+        self.latencies = deque(maxlen=500)
+        self.completed_at = deque(maxlen=500)
+
+    @property
+    def tracks(self):
+        """the people followed by the tracker, each one with its id and dwell time"""
+        return self.object_tracker.tracks
+
+    def set_zones(self, polygons):
+        """the motion is checked and the people are detected only near the zones"""
+        self._polygons = list(polygons)
+        if self.motion_gate is not None:
+            self.motion_gate.set_zones(self._polygons)
+        if self.frame_shape is not None:
+            self.region = self._zones_region(self._polygons)
+
+    def set_frame_shape(self, frame_shape):
+        """sizes the motion gate and the region on the frames of the camera, they are built again
+        if the frames change size, e.g. the camera was unreachable at the start or was replaced"""
+        frame_shape = tuple(frame_shape)
+        if frame_shape == self.frame_shape:
+            return
+        self.frame_shape = frame_shape
+        if self.motion_gating:
+            self.motion_gate = MotionGate(frame_shape, keep_alive=self.keep_alive)
+            self.motion_gate.set_zones(self._polygons)
+        self.region = self._zones_region(self._polygons)
+
+    def _zones_region(self, polygons):
+        """bounding box of all the zones with the padding, clipped to the frame"""
+        if not polygons:
+            return None
+        frame_height, frame_width = self.frame_shape[:2]
+        bounds = np.array([polygon.bounds for polygon in polygons])
+        x1 = max(0, int(bounds[:, 0].min() - self.roi_padding))
+        y1 = max(0, int(bounds[:, 1].min() - self.roi_padding))
+        x2 = min(frame_width, int(np.ceil(bounds[:, 2].max() + self.roi_padding)))
+        y2 = min(frame_height, int(np.ceil(bounds[:, 3].max() + self.roi_padding)))
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return x1, y1, x2, y2
+
+    def stats(self):
+        """throughput and latency of the last processed frames"""
+        stats = {'frames_skipped': self.frames_skipped,
+                 'frames_gated': self.frames_gated,
+                 'frames_completed': self.frames_completed,
+                 'results_dropped': self.results_dropped}
+        if len(self.completed_at) > 1:
+            window = self.completed_at[-1] - self.completed_at[0]
+            stats['fps'] = (len(self.completed_at) - 1) / window if window > 0 else 0.0
+        if self.latencies:
+            latencies = np.array(self.latencies) * 1000
+            stats['latency_ms_mean'] = float(latencies.mean())
+            stats['latency_ms_p50'] = float(np.percentile(latencies, 50))
+            stats['latency_ms_p95'] = float(np.percentile(latencies, 95))
+        return stats
+
+    def reset_stats(self):
+        self.frames_skipped = 0
+        self.frames_gated = 0
+        self.frames_completed = 0
+        self.results_dropped = 0
+        self.latencies.clear()
+        self.completed_at.clear()
 
 
 class VideoTracker:
-    def __new__(cls):
+    def __new__(cls, *args, **kwargs):
         if not hasattr(cls, 'instance'):
             cls.instance = super().__new__(cls)
         return cls.instance
 
-    def __init__(self):
+    def __init__(self, concurrency=5, batch_size=1, max_wait=0.02, max_result_age=1.0,
+                 detection_interval=2, motion_gating=True, keep_alive=2.0, roi_padding=150, imgsz=640):
+        """each of the concurrency workers runs the model on up to batch_size frames at once,
+        waiting at most max_wait seconds for the batch to fill.
+        The results of frames captured more than max_result_age seconds ago are discarded.
+        The detection runs once each detection_interval frames, the people are tracked in between.
+        With motion_gating the detection runs only if something moved near the zones
+        in the last keep_alive seconds.
+        Only the part of the frame around the zones, plus roi_padding pixels, is sent to the model
+        after being letterboxed to imgsz x imgsz pixels (e.g. 320, 416 or 640).
+        The cameras are added with add_camera, all of them share the workers"""
         self._results = JoinableQueue()
         self._jobs = JoinableQueue()
         self._model = YOLO('yolov8n.pt')
         self._started = False
-        self._create_processes(5)
-        self._frame_passed = 0
+        self._batch_size = batch_size
+        self._max_wait = max_wait
+        self._max_result_age = max_result_age
+        self._camera_options = (detection_interval, motion_gating, keep_alive, roi_padding)
+        self._cameras = []
+        self._metrics = Metrics()
+
+        # Each worker can have a full batch in flight, the frames travel in shared memory
+        # already resized to the inference size
+        self._letterbox = Letterbox(imgsz)
+        self._slots = SharedFrameSlots(concurrency * max(2, batch_size), (imgsz, imgsz, 3))
+        self._free_slots = deque(range(self._slots.slots))
+        atexit.register(self._slots.close)
+
+        # Camera, sequence number and capture time of the frame in each slot
+        self._slot_camera = [0] * self._slots.slots
+        self._slot_sequence = [0] * self._slots.slots
+        self._slot_frame_time = [0.0] * self._slots.slots
+        # Time each slot was submitted, used for the latency of the detection
+        self._submitted_at = [0.0] * self._slots.slots
+        # Position of the crop and letterbox transform of the frame in each slot
+        self._slot_region = [(0, 0)] * self._slots.slots
+        self._slot_transform = [(1.0, 1.0, 0, 0)] * self._slots.slots
+        # Trace of the frame in each slot, None if tracing is off
+        self._slot_trace = [None] * self._slots.slots
+
+        self._create_processes(concurrency)
 
     def is_started(self):
         return self._started
@@ -30,21 +178,54 @@ class VideoTracker:
     def stop(self):
         self._started = False
 
+    def add_camera(self, frame_shape=None):
+        """adds a camera with frames of frame_shape, if it's not known or not valid the first frame
+        is used. Returns the number of the camera"""
+        self._cameras.append(CameraStream(frame_shape, *self._camera_options))
+        return len(self._cameras) - 1
+
+    def camera(self, camera=0):
+        """returns the detection state of the camera"""
+        return self._cameras[camera]
+
+    @property
+    def cameras(self):
+        return len(self._cameras)
+
+    def set_zones(self, polygons, camera=0):
+        """called when the zones of the camera change"""
+        self._cameras[camera].set_zones(polygons)
+
+    def _next_batch(self):
+        """waits for a slot, then collects the other pending slots until the batch is full
+        or the deadline is reached"""
+        batch = [self._jobs.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._jobs.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
 
     def _process_results(self):
-        """detect a person box and put it in results if the tracking was started"""
+        """detect the person boxes in the frames of the slots received and writes them in the slot results"""
         while True:
-            results_box = []
-            if not self._jobs.empty():
-                frame = self._jobs.get()
-                model_results = self._model.predict(frame, True, verbose=False)
-                for result in model_results:
-                    for box in result.boxes.data.tolist():
-                        x, y, w, h, score, class_id = box
-                        # class_id 0 is the person id, score is the accuracy of the prediction
-                        if class_id == 0 and score >= 0.5:
-                            results_box.append((x, y, w, h))
-                self._results.put(results_box)
+            batch = self._next_batch()
+            frames = [self._slots.read_frame(slot) for slot in batch]
+            started = time.perf_counter()
+            # The results are returned in the same order of the frames
+            model_results = self._model.predict(frames, imgsz=self._letterbox.size, verbose=False)
+            finished = time.perf_counter()
+            for slot, result in zip(batch, model_results):
+                data = result.boxes.data.cpu().numpy()
+                # class_id 0 is the person id, score is the accuracy of the prediction
+                self._slots.write_results(slot, data[(data[:, 5] == 0) & (data[:, 4] >= 0.5), :5])
+                self._slots.write_timing(slot, started, finished)
+                self._results.put(slot)
 
     def _create_processes(self, concurrency):
         for _ in range(concurrency):
@@ -52,23 +233,143 @@ class VideoTracker:
             p.daemon = True
             p.start()
 
-    def object_detection(self, frame, interface: PygameInterface):
-        """identifies the people that enters the frame, creates a box and
-        put the center in the list """
-        # The detection is made one time each 3 frame, has to be 3 otherwise doesn't work
-        self._frame_passed += 1
-        if self._frame_passed == 2:
-            self._frame_passed = 0
-            self._jobs.put(frame)
-            centers = []
-            if not self._results.empty():
-                points = self._results.get()
-                for point in points:
-                    # Each person detected is represented as a point that is the center of a box
-                    x, y, w, h = point
-                    center = ((x + w / 2), (y + h / 2))
-                    centers.append(center)
-                    interface.create_box(x, y, w, h)
-            return centers
+    def submit_frame(self, frame, frame_time=None, camera=0, trace=None):
+        """copies the frame in a free slot and sends it to the workers, frame_time is when the frame
+        was captured. Returns False if the slots are busy and the frame is skipped"""
+        stream = self._cameras[camera]
+        stream.set_frame_shape(frame.shape)
+        # Each camera can use only its share of the slots, a busy camera doesn't slow down the others
+        if not self._free_slots or stream.in_flight >= max(1, self._slots.slots // len(self._cameras)):
+            stream.frames_skipped += 1
+            self._metrics.count("inference.frames_skipped")
+            return False
+        slot = self._free_slots.popleft()
+        # Only the region around the zones is letterboxed, the boxes are moved back in _collect_results
+        if stream.region is not None:
+            x1, y1, x2, y2 = stream.region
+            image = frame[y1:y2, x1:x2]
+            self._slot_region[slot] = (x1, y1)
         else:
-            return []
+            image = frame
+            self._slot_region[slot] = (0, 0)
+        started = time.time()
+        with self._metrics.timer("inference.preprocess"):
+            self._slot_transform[slot] = self._slots.write_frame(slot, image, self._letterbox)
+        if trace is not None:
+            trace.add("preprocess", started, time.time())
+        self._slot_trace[slot] = trace
+        stream.sequence += 1
+        stream.in_flight += 1
+        self._slot_camera[slot] = camera
+        self._slot_sequence[slot] = stream.sequence
+        self._slot_frame_time[slot] = frame_time if frame_time is not None else time.time()
+        self._submitted_at[slot] = time.perf_counter()
+        self._jobs.put(slot)
+        self._metrics.gauge("inference.slots_in_flight", self._slots.slots - len(self._free_slots))
+        return True
+
+    def _collect_results(self):
+        """reads all the results ready and keeps the newest of each camera.
+        Results older than the ones already returned or than max_result_age are discarded"""
+        while not self._results.empty():
+            slot = self._results.get()
+            stream = self._cameras[self._slot_camera[slot]]
+            # The boxes are mapped from the letterboxed square to the frame coordinates
+            boxes = Letterbox.unmap(self._slots.read_results(slot), self._slot_transform[slot],
+                                    self._slot_region[slot])
+            self._free_slots.append(slot)
+            stream.in_flight -= 1
+
+            now = time.perf_counter()
+            stream.latencies.append(now - self._submitted_at[slot])
+            stream.completed_at.append(now)
+            stream.frames_completed += 1
+            # The time in the jobs queue, in the model and in the results queue are measured apart
+            started, finished = self._slots.read_timing(slot)
+            self._metrics.observe("inference.queue_wait", started - self._submitted_at[slot])
+            self._metrics.observe("inference.model", finished - started)
+            self._metrics.observe("inference.result_wait", now - finished)
+            self._metrics.count("inference.frames_completed")
+            self._metrics.gauge("inference.slots_in_flight", self._slots.slots - len(self._free_slots))
+            trace, self._slot_trace[slot] = self._slot_trace[slot], None
+            if trace is not None:
+                # The times of the workers are moved from perf_counter to the clock of the traces
+                offset = time.time() - now
+                trace.add("queue_wait", self._submitted_at[slot] + offset, started + offset)
+                trace.add("inference", started + offset, finished + offset)
+                trace.add("result_wait", finished + offset, now + offset)
+
+            sequence, frame_time = self._slot_sequence[slot], self._slot_frame_time[slot]
+            # The workers can finish out of order, only newer frames are kept
+            if sequence <= stream.last_sequence or time.time() - frame_time > self._max_result_age:
+                stream.results_dropped += 1
+                self._metrics.count("inference.results_dropped")
+                continue
+            if stream.newest is not None:
+                stream.results_dropped += 1
+                self._metrics.count("inference.results_dropped")
+            stream.last_sequence = sequence
+            stream.newest = (sequence, frame_time, boxes)
+            stream.newest_trace = trace
+
+    def get_results(self, camera=0):
+        """returns (sequence, frame time, boxes) of the newest frame of the camera processed
+        since the last call, None if there aren't new results"""
+        self._collect_results()
+        stream = self._cameras[camera]
+        newest, stream.newest = stream.newest, None
+        if newest is not None:
+            stream.result_trace, stream.newest_trace = stream.newest_trace, None
+        return newest
+
+    def inference_stats(self, camera=0):
+        """throughput and latency of the last processed frames of the camera"""
+        return self._cameras[camera].stats()
+
+    def reset_stats(self):
+        for stream in self._cameras:
+            stream.reset_stats()
+
+    def object_detection(self, frame, frame_time=None, camera=0, trace=None):
+        """identifies the people that enters the frame, creates a box and
+        put the center in the list. The stages are added to the trace of the frame if there is one"""
+        stream = self._cameras[camera]
+        stream.set_frame_shape(frame.shape)
+        if frame_time is None:
+            frame_time = time.time()
+        # The detection is made one time each detection_interval frames
+        stream.frame_passed += 1
+        if stream.frame_passed >= stream.detection_interval:
+            stream.frame_passed = 0
+            started = time.time()
+            moving = stream.motion_gate is None or stream.motion_gate.check(frame, frame_time)
+            if trace is not None:
+                trace.add("motion", started, time.time())
+            if moving:
+                self.submit_frame(frame, frame_time, camera, trace)
+            else:
+                # Nothing moved, the people tracked are still where they were
+                stream.frames_gated += 1
+                self._metrics.count("inference.frames_gated")
+                stream.object_tracker.freeze(frame_time)
+
+        # The tracks are corrected when a detection is ready, at the time its frame was captured
+        result = self.get_results(camera)
+        started = time.time()
+        if result is not None:
+            sequence, result_frame_time, boxes = result
+            stream.object_tracker.update(boxes[:, :4], result_frame_time)
+            if trace is not None:
+                # The people of this frame were detected in the frame of the result
+                trace.source = stream.result_trace
+
+        centers = []
+        stream.boxes = []
+        for track, box in stream.object_tracker.predict(frame_time):
+            # Each person tracked is represented as a point that is the center of a box
+            x1, y1, x2, y2 = box.tolist()
+            centers.append(((x1 + x2) / 2, (y1 + y2) / 2))
+            stream.boxes.append((x1, y1, x2 - x1, y2 - y1))
+        if trace is not None:
+            trace.add("tracking", started, time.time())
+        return centers
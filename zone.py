@@ -1,20 +1,44 @@
+import ast
+import json
 import math
-from shapely import Polygon
+import time
+from typing import TYPE_CHECKING
+
+from shapely import Point, Polygon
 
 import lights_control
-from pygame_interface import PygameInterface
+from metrics import Metrics
+from occupancy import OccupancyEngine
+
+# The interface is optional, pygame is not imported in headless mode
+if TYPE_CHECKING:
+    from pygame_interface import PygameInterface
 
 
 class Zone:
     zones = {}
     people_in_zone = {}
     collider_borders = 50
-
-    def __init__(self, points):
+    # Spatial index of the zones of each camera, rebuilt only when the zones of the camera change
+    _engines = {}
+    _indexed_zones = {}
+    # Functions called with the zone polygons and the camera each time the zones of a camera change
+    listeners = []
+    # Camera shown on the interface, only its zones are drawn
+    interface_camera = 0
+    # Cameras that can have zones, None is any camera
+    cameras = None
+    # Zones by key, used to find duplicated zones without comparing the polygons
+    _keys = {}
+    _metrics = Metrics()
+
+    def __init__(self, points, hold_time=None, light=None, camera=0):
         ordered_points = self.order_points_clockwise(points)
+        self.camera = camera
+        self.key = self.zone_key(ordered_points, camera)
         self.zone_polygon = Polygon(ordered_points)
         self.people_count = 0
-        self.light = lights_control.Light()
+        self.light = light if light is not None else lights_control.Light(hold_time)
 
 
     def __str__(self):
@@ -22,68 +46,160 @@ class Zone:
         l.remove(l[0])
         return str(l)
 
-    def update(self, people):
+    def update(self, people, trace=None):
         if people > 0:
-            self.light.light_on()
+            self.light.light_on(trace)
         else:
-            self.light.light_off()
+            self.light.light_off(trace)
 
         self.people_count = people
         Zone.zones[self] = self.people_count
 
-    def contains(self, point):
-        """return True if the polygon intersects the square created by the center given"""
-        x,y = point
-        borders = Zone.collider_borders
-        collide = Polygon([(x-borders,y-borders),(x-borders,y+borders),(x+borders,y+borders),(x+borders,y-borders)])
-        return self.zone_polygon.intersects(collide)
+    @classmethod
+    def create_zone(cls, points: list, interface: "PygameInterface" = None, hold_time=None, camera=0):
+        """creates a new Zone instance on the frames of camera, hold_time is how many seconds the light
+        stays on after the zone becomes empty. The zone is shown on the interface if there is one"""
+        if cls.cameras is not None and camera not in cls.cameras:
+            print(f"Camera {camera} is not configured, the zone is not created")
+            return
+        if cls.zone_key(cls.order_points_clockwise(points), camera) in cls._keys:
+            print("Zone Already Created")
+            return
+        new_zone = Zone(points, hold_time, camera=camera)
+        print("New Zone Created" + str(new_zone))
+        cls._add(new_zone, interface)
+        cls._zones_changed({camera})
+        return new_zone
 
+    @classmethod
+    def _add(cls, zone, interface: "PygameInterface" = None):
+        cls.zones[zone] = zone.people_count
+        cls._keys[zone.key] = zone
+        if interface is not None and zone.camera == cls.interface_camera:
+            interface.add_zone(zone.zone_polygon, zone.light)
 
+    @classmethod
+    def remove_zone(cls, zone, interface: "PygameInterface" = None):
+        """removes the zone and disposes its light, the other zones are not changed"""
+        if cls._keys.get(zone.key) is not zone:
+            return
+        del cls._keys[zone.key]
+        cls.zones.pop(zone, None)
+        cls.people_in_zone.pop(zone, None)
+        zone.dispose()
+        cls._zones_changed({zone.camera})
+        if interface is not None and zone.camera == cls.interface_camera:
+            interface.remove_zone(zone.zone_polygon)
+        print("Zone Removed" + str(zone))
+
+    def dispose(self):
+        """switches off and removes the light of the zone"""
+        self.light.dispose()
 
     @classmethod
-    def create_zone(cls, points: list, interface: PygameInterface):
-        """creates a new Zone instance"""
-        ordered_points = cls.order_points_clockwise(points)
-        new_zone_polygon = Polygon(ordered_points)
-        for zone in Zone.zones:
-            if zone.zone_polygon == new_zone_polygon:
-                print("Zone Already Created")
-                return
-        new_zone = Zone(points)
-        print("New Zone Created" + str(new_zone))
-        cls.zones[new_zone] = new_zone.people_count
-        interface.add_zone(new_zone_polygon,new_zone.light)
+    def zone_at(cls, point, camera=0):
+        """returns a zone of the camera that contains the point, None if there isn't one"""
+        for zone in cls.zones:
+            if zone.camera == camera and zone.zone_polygon.covers(Point(point)):
+                return zone
+        return None
 
     @classmethod
-    def update_zone(cls, points: list[(float, float)]):
-        """check how many people are in each zone and manages changes"""
-        cls.people_in_zone.clear()
+    def _zones_changed(cls, cameras):
+        """invalidates the zone index of the cameras and notifies the listeners"""
+        for camera in cameras:
+            cls._indexed_zones.pop(camera, None)
+            polygons = [zone.zone_polygon for zone in cls.zones if zone.camera == camera]
+            for listener in cls.listeners:
+                listener(polygons, camera)
+
+    @classmethod
+    def update_zone(cls, points: list[(float, float)], camera=0, trace=None):
+        """check how many people are in each zone of the camera and manages changes,
+        the trace of the frame is passed to the lights switched"""
+        started = time.perf_counter()
+        started_at = time.time()
+        if camera not in cls._indexed_zones:
+            cls._indexed_zones[camera] = [zone for zone in cls.zones if zone.camera == camera]
+            engine = cls._engines.setdefault(camera, OccupancyEngine())
+            engine.set_polygons(zone.zone_polygon for zone in cls._indexed_zones[camera])
+
+        # All the centers are tested against all the zones of the camera in one call
+        counts = cls._engines[camera].count(points, cls.collider_borders)
+        if trace is not None:
+            trace.add("zones", started_at, time.time())
+        for zone, people in zip(cls._indexed_zones[camera], counts.tolist()):
+            cls.people_in_zone[zone] = people
+            if people != cls.zones[zone]:
+                zone.update(people, trace)
+        cls._metrics.observe("zones.update", time.perf_counter() - started)
+
+    @classmethod
+    def save_zones(cls, path="zones.json"):
+        """writes the actual zones, with the addresses and the hold time of their lights, in the zones file"""
+        zones = []
         for zone in cls.zones.keys():
-            cls.people_in_zone[zone] = 0
-            if points:
-                for point in points:
-                    if zone.contains(point):
-                        cls.people_in_zone[zone] += 1
-                    else:
-                        cls.people_in_zone[zone] = 0
-
-        for zone in cls.people_in_zone.keys():
-            if cls.people_in_zone[zone] != cls.zones[zone]:
-                zone.update(cls.people_in_zone[zone])
+            zones.append({'points': list(zone.zone_polygon.exterior.coords)[:-1],
+                          'address': zone.light.address,
+                          'status_address': zone.light.status_address,
+                          'hold_time': zone.light.hold_time,
+                          'camera': zone.camera})
+        # One zone for each line, the file stays readable with many zones
+        with open(path, "w") as file:
+            file.write('{"version": 1, "zones": [\n')
+            file.write(",\n".join(json.dumps(zone) for zone in zones))
+            file.write('\n]}\n')
+
+    @staticmethod
+    def read_zones_file(path):
+        """returns the zones written in the file as dictionaries, the .txt files have a list of points each line"""
+        with open(path, "r") as file:
+            if path.endswith(".txt"):
+                return [{'points': ast.literal_eval(line)} for line in file if line.strip()]
+            return json.load(file)['zones']
 
     @classmethod
-    def save_zones(cls):
-        """writes the actual zones in zones.txt"""
-        with open("zones.txt", "w") as file:
-            for zone in cls.zones.keys():
-                file.write(str(zone) + "\n")
+    def load_zones(cls, interface: "PygameInterface" = None, path="zones.json"):
+        """creates all the zones written in the zones file at once, the repeated zones are skipped"""
+        new_zones = {}
+        for record in cls.read_zones_file(path):
+            if cls.cameras is not None and record.get('camera', 0) not in cls.cameras:
+                print(f"Zone skipped, camera {record.get('camera', 0)} is not configured: {record['points']}")
+                continue
+            key = cls.zone_key(cls.order_points_clockwise(record['points']), record.get('camera', 0))
+            if key not in cls._keys and key not in new_zones:
+                new_zones[key] = record
+        if not new_zones:
+            print("Zones Already Created")
+            return
+
+        # The lights are created and switched off together
+        lights = lights_control.Light.create_lights(
+            (record.get('hold_time'), record.get('address'), record.get('status_address'))
+            for record in new_zones.values())
+        for record, light in zip(new_zones.values(), lights):
+            cls._add(Zone(record['points'], light=light, camera=record.get('camera', 0)), interface)
+        # The index and the listeners are updated once for each camera
+        cls._zones_changed({record.get('camera', 0) for record in new_zones.values()})
+        print(f"{len(new_zones)} Zones Loaded")
 
     @classmethod
-    def delete_zones(cls, interface: PygameInterface):
-        """delete all zones objects and clean zones.txt"""
+    def delete_zones(cls, interface: "PygameInterface" = None):
+        """delete all zones objects"""
+        cameras = {zone.camera for zone in cls.zones}
+        for zone in cls.zones:
+            zone.dispose()
         cls.zones.clear()
-        lights_control.Light.clear_lights()
-        interface.delete_zones()
+        cls._keys.clear()
+        cls.people_in_zone.clear()
+        cls._zones_changed(cameras)
+        if interface is not None:
+            interface.delete_zones()
+
+    @staticmethod
+    def zone_key(ordered_points, camera=0):
+        """hashable key of the zone, the zones with the same points on the same camera have the same key"""
+        return camera, tuple((round(x, 3), round(y, 3)) for x, y in ordered_points)
 
     @staticmethod
     def order_points_clockwise(points):